@@ -6,16 +6,18 @@ from telegram.ext import (
     InlineQueryHandler, CallbackQueryHandler, ContextTypes, filters
 )
 
-from config import TOKEN, OWNER_ID, CACHE_CHAT_ID
+from config import TOKEN, OWNER_ID, CACHE_CHAT_ID, UPDATE_CONCURRENCY
 from state import set_bot_identity, get_pyro_app
 from utils.filters import build_media_filter
-from handlers.commands import start, id_cmd
+from handlers.commands import start, id_cmd, stats_cmd
 from handlers.files_id import send_file_ids
 from handlers.messages import handle_message
 from handlers.inline import inline_query
 from handlers.buttons import button_callback
 from handlers.cache_listener import cache_listener
-from services.cache_db import db_init
+from services.cache_db import db_init, db_close, cache_warm
+from services import task_store, local_store
+from utils.update_processor import KeyedUpdateProcessor
 from config import PYRO_API_ID, PYRO_API_HASH, PYRO_SESSION
 from pyrogram import Client as PyroClient
 
@@ -26,6 +28,9 @@ async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE):
     
 async def on_startup(app_):
     db_init()
+    await cache_warm()
+    await task_store.start()
+    await local_store.start()
     me = await app_.bot.get_me()
     await set_bot_identity(me.username, me.id)  # <- ключевое, чтобы userbot слал в DM боту
     logging.info(f"[BOT] Я @{me.username} (id={me.id})")
@@ -38,13 +43,23 @@ async def on_startup(app_):
 
 async def on_shutdown(app_):
     from state import close_pyro_app
+    from services.ytdlp_pool import shutdown as shutdown_ytdlp_pool
     await close_pyro_app()
+    await task_store.stop()
+    await local_store.stop()
+    await db_close()
+    shutdown_ytdlp_pool()
 
 def main():
-    app = ApplicationBuilder().token(TOKEN).build()
+    builder = ApplicationBuilder().token(TOKEN)
+    if UPDATE_CONCURRENCY > 1:
+        # апдейты параллельно, но по одному на инлайн-пост/чат
+        builder = builder.concurrent_updates(KeyedUpdateProcessor(UPDATE_CONCURRENCY))
+    app = builder.build()
     app.add_handler(CommandHandler("start", start))
     app.add_handler(MessageHandler(filters.User(OWNER_ID) & build_media_filter(), send_file_ids))
     app.add_handler(CommandHandler("id", id_cmd, filters=filters.User(OWNER_ID)))
+    app.add_handler(CommandHandler("stats", stats_cmd, filters=filters.User(OWNER_ID)))
     app.add_handler(MessageHandler(filters.ChatType.PRIVATE & URL_FILTER, handle_message))
     app.add_handler(MessageHandler((filters.ChatType.GROUP | filters.ChatType.SUPERGROUP) & URL_FILTER, handle_message))
     app.add_handler(InlineQueryHandler(inline_query))
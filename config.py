@@ -1,7 +1,6 @@
 #config.py
 import os
 from pathlib import Path
-from asyncio import Semaphore
 
 
 # === Конфигурация / константы ===
@@ -30,10 +29,101 @@ if not COOKIES_FILE and os.path.exists("/opt/mybot/video/cookies.txt"):
 SMART_FMT = "bv*[height<=1080]+ba/b[height<=1080]/b"
 SMART_FMT_1080 = SMART_FMT
 GIF_FMT = "bv*[height<=480]+ba/b[height<=480]/b"
+# исходник для тихой анимации, когда локального нет: звук не нужен — только видео ≤480p
+ANIM_SRC_FMT = "bv*[height<=480]/b[height<=480]/b"
 
 
-# Лимит параллельных тяжёлых задач
-DL_SEM = Semaphore(int(os.getenv("MAX_PARALLEL", "2")))
+# Бэкенд yt-dlp для -J (метаданные): "pool" — долгоживущие процессы с Python API,
+# "subprocess" — fork yt-dlp на каждый вызов. Скачивания всегда идут отдельным процессом yt-dlp.
+YTDLP_BACKEND = os.getenv("YTDLP_BACKEND", "pool").lower()
+YTDLP_WORKERS = int(os.getenv("YTDLP_WORKERS", "2"))
+# дедлайн одного -J: зависший экстрактор не держит поток и лок URL в meta_cache вечно
+YTDLP_INFO_TIMEOUT = int(os.getenv("YTDLP_INFO_TIMEOUT", "120"))
+# общий --cache-dir (плеер/подписи YouTube) для пула и subprocess
+YTDLP_CACHE_DIR = os.getenv("YTDLP_CACHE_DIR", os.path.join(SAVE_DIR, ".ytdlp-cache"))
+# дедлайны async-скачивания: на весь процесс и «нет вывода» (зависший yt-dlp не держит слот)
+YTDLP_DL_TIMEOUT = int(os.getenv("YTDLP_DL_TIMEOUT", "1800"))
+YTDLP_STALL_TIMEOUT = int(os.getenv("YTDLP_STALL_TIMEOUT", "180"))
+FFMPEG_TIMEOUT = int(os.getenv("FFMPEG_TIMEOUT", "900"))
+# ffprobe и кадр-превью — быстрые операции
+FFPROBE_TIMEOUT = int(os.getenv("FFPROBE_TIMEOUT", "30"))
+
+
+# Кэш метаданных yt-dlp (-J): LRU в памяти + SQLite рядом с cache.db
+META_DB_PATH = os.path.join(SAVE_DIR, "meta.db")
+META_LRU_SIZE = int(os.getenv("META_LRU_SIZE", "256"))
+META_TTL_DEFAULT = int(os.getenv("META_TTL_DEFAULT", "3600"))
+# TTL по экстрактору в секундах, формат: "youtube=18000,tiktok=1800"
+META_TTL = {
+    name.strip().lower(): int(ttl)
+    for name, ttl in (
+        part.split("=", 1)
+        for part in os.getenv("META_TTL", "youtube=18000,tiktok=1800,instagram=1800,twitter=3600").split(",")
+        if "=" in part
+    )
+}
+
+
+# Предвыборка метаданных на inline_query (пока юзер не нажал кнопку)
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_MAX_PARALLEL = int(os.getenv("PREFETCH_MAX_PARALLEL", "2"))
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "32"))
+PREFETCH_TTL = int(os.getenv("PREFETCH_TTL", "600"))
+
+
+# Прогресс скачивания в подписях: не чаще раза в N секунд на сообщение + общий лимит правок/с
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", "3"))
+PROGRESS_GLOBAL_RATE = float(os.getenv("PROGRESS_GLOBAL_RATE", "20"))
+
+
+# Сколько апдейтов обрабатывать одновременно (1 — последовательно, как PTB по умолчанию)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+
+# Инлайн-задачи task_id → URL: живут TASK_TTL, в памяти не больше TASK_MEM_MAX, в SQLite пачками
+TASK_TTL = int(os.getenv("TASK_TTL", str(30 * 24 * 3600)))
+TASK_MEM_MAX = int(os.getenv("TASK_MEM_MAX", "200000"))
+TASK_FLUSH_INTERVAL = float(os.getenv("TASK_FLUSH_INTERVAL", "2"))
+
+
+# Слоты планировщика тяжёлых задач (services/scheduler): сеть / CPU-транскод / аплоад
+SCHED_NET_SLOTS = int(os.getenv("MAX_PARALLEL", "2"))
+SCHED_CPU_SLOTS = int(os.getenv("SCHED_CPU_SLOTS", "1"))
+SCHED_UPLOAD_SLOTS = int(os.getenv("SCHED_UPLOAD_SLOTS", "2"))
+
+
+# cache.db: потоков-читателей (у каждого своё соединение) и макс. записей в одном коммите
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", "256"))
+# горячий LRU перед cache_get: размер, сколько помнить промах (сек), сколько строк греть на старте
+CACHE_HOT_SIZE = int(os.getenv("CACHE_HOT_SIZE", "5000"))
+CACHE_NEG_TTL = float(os.getenv("CACHE_NEG_TTL", "30"))
+CACHE_WARM_ROWS = int(os.getenv("CACHE_WARM_ROWS", "1000"))
+
+
+# Инлайн: пауза, пока юзер печатает (сек); сколько одна ссылка держит один task/результат;
+# cache_time ответа на стороне Telegram
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", "0.6"))
+INLINE_REUSE_TTL = int(os.getenv("INLINE_REUSE_TTL", "600"))
+INLINE_REUSE_MAX = int(os.getenv("INLINE_REUSE_MAX", "10000"))
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "30"))
+
+# ЛС с несколькими ссылками: сколько готовое ждёт соседей, чтобы уйти одним альбомом (сек)
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", "2"))
+
+
+# Локальное хранилище исходников (services/local_store): сколько живут и потолок по диску
+LOCAL_STORE_TTL = int(os.getenv("LOCAL_STORE_TTL", str(6 * 3600)))
+LOCAL_STORE_MAX_MB = int(os.getenv("LOCAL_STORE_MAX_MB", "5000"))
+# как часто фоновая уборка выкидывает просроченное, даже если новых загрузок нет (сек)
+LOCAL_STORE_SWEEP_INTERVAL = int(os.getenv("LOCAL_STORE_SWEEP_INTERVAL", "600"))
+# Bot API отдаёт через getFile только файлы до 20 MB
+TG_DOWNLOAD_MAX = 20 * 1024 * 1024
+
+
+# Ключ подписи callback_data (HMAC); пусто — выводится из BOT_TOKEN.
+# Одинаковый у всех процессов бота, иначе чужие кнопки не пройдут проверку.
+CALLBACK_SECRET = os.getenv("CALLBACK_SECRET", "")
 
 
 Path(SAVE_DIR).mkdir(parents=True, exist_ok=True)
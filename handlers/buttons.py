@@ -3,80 +3,100 @@ import os
 import asyncio
 import logging
 import subprocess
-from typing import Optional, Dict, Tuple
+from typing import Optional
 
-from telegram import InputMediaVideo, InputMediaAudio, InputMediaAnimation, InputFile
+from telegram import InputMediaVideo, InputMediaAudio, InputMediaAnimation, InputMediaDocument
 from telegram.error import BadRequest
 from telegram.ext import ContextTypes
 
-from state import DOWNLOAD_TASKS
+from services.task_store import get_task
 
 # === ваши сервисы ===
-from services.video import get_video_info, generate_thumbnail, video_to_tg_animation
-from services.ytdlp import download_video_with_format, download_video_smart, download_audio
-from services.content_key import get_content_key_and_title, detect_media_kind_and_key, extract_title_artist, canon_key
-from services.cache_db import cache_get, cache_put
-from services.pyro_send import send_via_userbot
+from services.video import video_to_tg_animation, video_to_gif, extract_audio
+from services.ytdlp import download_video_with_format_async, download_video_smart_async, download_audio_async
+from services.content_key import get_content_key_and_title, detect_media_kind_and_key, extract_title_artist
+from services.cache_db import cache_get, cache_put, alias_get
+from services.prefetch import get_prefetched
+from services.meta_cache import peek_info
+from services.progress import ProgressCaption
+from services.scheduler import scheduler, estimate_cost, NET, CPU, UPLOAD
+from services.singleflight import MediaResult
+from services.media_pipeline import obtain, upload_video, source_for
+from services import local_store
+from utils.url_keys import offline_content_key, url_for_key
+from utils.callback_data import decode_callback
 
 # ─────────────────────────────────────────────────────────
 # Константы/настройки
-from config import CACHE_CHAT_ID, CACHE_THREAD_ID, MAX_TG_SIZE, DL_SEM, SMART_FMT_1080, GIF_FMT
-
-# Анти-дубли: один ключ (content_key, variant) — одно одновременное скачивание
-INFLIGHT: Dict[Tuple[str, str], asyncio.Lock] = {}
-
-def cache_get_any(content_key: str, variant: str):
-    # пробуем канонический ключ
-    k1 = canon_key(content_key)
-    row = cache_get(k1, variant)
-    if row:
-        return row
-    # пробуем альтернативу с другим регистром "youtube"/"YouTube"
-    if ":" in content_key:
-        prefix, rest = content_key.split(":", 1)
-        alt_prefixes = {prefix.lower(), prefix.capitalize(), prefix.upper(), "YouTube", "youtube"}
-        for p in alt_prefixes:
-            k2 = f"{p}:{rest}"
-            if k2 == k1:
-                continue
-            row = cache_get(k2, variant)
-            if row:
-                return row
-    return None
-
-def get_inflight_lock(content_key: str, variant: str) -> asyncio.Lock:
-    k = (content_key, variant)
-    lk = INFLIGHT.get(k)
-    if not lk:
-        lk = asyncio.Lock()
-        INFLIGHT[k] = lk
-    return lk
-
+from config import CACHE_CHAT_ID, CACHE_THREAD_ID, SMART_FMT_1080, GIF_FMT, SAVE_DIR, ANIM_SRC_FMT
 
 async def _run_io(func, *args, **kwargs):
     return await asyncio.to_thread(func, *args, **kwargs)
 
 
+# вариант, который кнопка отдаёт из кэша (для "auto" — видео, как и при детекте)
+_FAST_VARIANTS = {"auto": "video:smart1080", "vauto": "video:smart1080", "aauto": "audio:mp3",
+                  "gif": "anim:50", "giffile": "gif:file"}
+_AUDIO_FORMATS = ("mp3", "m4a")
+
+def _input_media(media: MediaResult, url: str):
+    if media.kind == "audio":
+        return InputMediaAudio(media=media.file_id, caption=f"Аудио готово: {url}")
+    if media.kind == "animation":
+        return InputMediaAnimation(media=media.file_id, caption=f"GIF готова: {url}")
+    if media.kind == "document":
+        return InputMediaDocument(media=media.file_id, caption=f"GIF готова: {url}")
+    return InputMediaVideo(media=media.file_id, caption=f"Видео готово: {url}")
+
+
+def _remove(*paths):
+    for p in paths:
+        try:
+            if p and os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
+
+
 async def button_callback(update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = (query.data or "")
     await query.answer()
 
-    try:
-        parts = data.split("|")
-        action = parts[0]
-        task_id = parts[1] if len(parts) > 1 else ""
-    except Exception:
-        logging.error(f"[BTN] bad callback data: {data!r}")
+    cb = decode_callback(data)
+    if cb is None:
+        logging.error(f"[BTN] bad or unsigned callback data: {data!r}")
         return
-
-    url = DOWNLOAD_TASKS.get(task_id)
+    action, task_id, fmt = cb.action, cb.task_id, cb.fmt
     inline_id = query.inline_message_id  # критично для инлайна!
 
-    logging.info(f"[BTN] action={action} task={task_id} url={url} inline_id={inline_id}")
+    # быстрый путь: ключ приехал в самой кнопке → сразу в SQLite, без задачи и yt-dlp
+    if action == "fmt" and fmt:
+        variant = f"video:fmt={fmt}"
+    elif action == "aud" and fmt in _AUDIO_FORMATS:
+        variant = f"audio:{fmt}"
+    else:
+        variant = _FAST_VARIANTS.get(action)
+    if cb.content_key and variant:
+        row = await cache_get(cb.content_key, variant)
+        if row:
+            link = url_for_key(cb.content_key) or await get_task(task_id) or ""
+            logging.info(f"[CACHE HIT/CALLBACK] {cb.content_key} [{variant}] → {row['file_id']}")
+            try:
+                await context.bot.edit_message_media(
+                    inline_message_id=inline_id, media=_input_media(MediaResult.from_row(row), link)
+                )
+            except BadRequest as e:
+                logging.error(f"[BTN] edit media fail (callback cache): {e}")
+            return
+
+    # промах — нужна ссылка: из реестра задач, иначе восстанавливаем по ключу
+    url = await get_task(task_id) or url_for_key(cb.content_key)
+
+    logging.info(f"[BTN] action={action} task={task_id} key={cb.content_key} url={url} inline_id={inline_id}")
 
     if not url:
-        # инлайн-пост живёт, а словарь перезапустился — показываем ошибку
+        # задача истекла (TASK_TTL) или её не было — показываем ошибку
         try:
             if inline_id:
                 await context.bot.edit_message_caption(
@@ -89,6 +109,9 @@ async def button_callback(update, context: ContextTypes.DEFAULT_TYPE):
             logging.error(f"[BTN] could not set error caption: {e}")
         return
 
+    # ключ без yt-dlp: из кнопки, из самой ссылки или из алиасов уже виденных ссылок
+    known_key = cb.content_key or offline_content_key(url) or await alias_get(url)
+
     async def _set_caption(text: str, kb=None):
         try:
             if inline_id:
@@ -109,6 +132,108 @@ async def button_callback(update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 logging.error(f"[BTN] edit_message_caption fail: {e}")
 
+    user_id = query.from_user.id if query.from_user else None
+
+    def _slot(pool: str, kind: str = "video"):
+        # очередь планировщика: владелец/мало задач у юзера/короткий ролик — раньше
+        return scheduler.slot(pool, user_id=user_id, cost=estimate_cost(peek_info(url, memory_only=True), kind), label=action)
+
+    async def _info():
+        # -J из meta.db для загрузки — чтение SQLite+распаковка не в event loop
+        return await _run_io(peek_info, url)
+
+    async def _upload(coro):
+        async with _slot(UPLOAD):
+            return await coro
+
+    async def _download(header: str, fn, *args, **kwargs):
+        # скачивание с живым прогрессом (%, скорость, ETA) в подписи инлайн-поста
+        progress = ProgressCaption(_set_caption, header)
+        try:
+            return await fn(*args, on_progress=progress, **kwargs)
+        finally:
+            await progress.aclose()
+
+    async def _deliver(media: MediaResult) -> bool:
+        try:
+            await context.bot.edit_message_media(inline_message_id=inline_id, media=_input_media(media, url))
+            return True
+        except BadRequest as e:
+            logging.error(f"[BTN] edit media fail: {e}")
+            return False
+
+    async def _obtain(content_key: str, variant: str, produce) -> MediaResult:
+        return await obtain(content_key, variant, produce,
+                            on_join=lambda: _set_caption("Уже готовлю этот файл, подожди…"))
+
+    async def _upload_video(video_path: str, content_key: str, variant: str,
+                            title: Optional[str], fmt_used: str) -> MediaResult:
+        return await upload_video(
+            context.bot, video_path, content_key, variant, title=title, fmt_used=fmt_used, url=url,
+            user_id=user_id, cost=estimate_cost(peek_info(url, memory_only=True)),
+        )
+
+    async def _derive(content_key: str, header: str, convert, *args):
+        """
+        Производный файл (GIF/анимация): из локального исходника, иначе качаем видео ≤480p без звука.
+        → (готовый файл, скачанный исходник или None) — оба удаляет вызывающий.
+        """
+        async with source_for(context.bot, content_key) as local:
+            if local:
+                try:
+                    async with _slot(CPU, "anim"):
+                        return await convert(local, *args, out_dir=SAVE_DIR), None
+                except Exception as e:
+                    logging.warning(f"[GIF] local source failed, downloading: {e}")
+        async with _slot(NET, "anim"):
+            src = await _download(header, download_video_with_format_async, url, ANIM_SRC_FMT, info=await _info())
+        try:
+            async with _slot(CPU, "anim"):
+                return await convert(src, *args, out_dir=SAVE_DIR), src
+        except BaseException:
+            _remove(src)  # и при отмене: ffmpeg уже убит, исходник больше не нужен
+            raise
+
+    def _produce_audio(content_key: str, title: Optional[str], audio_fmt: str):
+        variant = f"audio:{audio_fmt}"
+
+        async def produce() -> MediaResult:
+            await _set_caption(f"Готовлю аудио ({audio_fmt})…")
+            audio_path = None
+            try:
+                # видео этого ролика уже на диске (или в Telegram) — режем звук локально
+                async with source_for(context.bot, content_key) as src:
+                    if src:
+                        try:
+                            async with _slot(CPU, "audio"):
+                                audio_path = await extract_audio(src, audio_fmt, SAVE_DIR)
+                        except Exception as e:
+                            logging.warning(f"[AUDIO] local extract failed, downloading: {e}")
+                if not audio_path:
+                    async with _slot(NET, "audio"):
+                        audio_path = await _download(f"Готовлю аудио ({audio_fmt})…", download_audio_async, url, audio_fmt, info=await _info())
+                title_full, artist = await _run_io(extract_title_artist, url, title)
+                sent = await _upload(context.bot.send_audio(
+                    chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
+                    audio=open(audio_path, "rb"),
+                    title=title_full, performer=artist,
+                    caption=f"Аудио готово: {url}",
+                ))
+                file_id = sent.audio.file_id
+                duration = getattr(sent.audio, "duration", None)
+                await cache_put(
+                    content_key, variant, kind="audio",
+                    file_id=file_id, file_unique_id=sent.audio.file_unique_id,
+                    width=None, height=None, duration=duration,
+                    size=os.path.getsize(audio_path), fmt_used=audio_fmt, title=title_full, artist=artist or None, source_url=url
+                )
+                logging.info(f"[DB] saved {content_key} [{variant}] → {file_id}")
+                return MediaResult("audio", file_id, duration=duration)
+            finally:
+                _remove(audio_path)
+
+        return variant, produce
+
     # ─────────────────────────────────────────────────────────
     # Служебные ветки
     if action == "noop":
@@ -116,114 +241,62 @@ async def button_callback(update, context: ContextTypes.DEFAULT_TYPE):
 
     if action == "more":
         from services.keyboard import build_full_format_keyboard  # импорт внутри, чтобы избежать циклических импортов
-        kb = build_full_format_keyboard(task_id, url)
+        kb = await _run_io(build_full_format_keyboard, task_id, url, known_key)
         await _set_caption(f"Все форматы для:\n{url}", kb)
         return
 
+    # кнопки без ключа (старые или неизвестный сайт): ключ нашёлся по ссылке → сразу в SQLite
+    if variant and known_key and known_key != cb.content_key:
+        row = await cache_get(known_key, variant)
+        if row:
+            logging.info(f"[CACHE HIT/OFFLINE] {known_key} [{variant}] → {row['file_id']}")
+            try:
+                await context.bot.edit_message_media(
+                    inline_message_id=inline_id, media=_input_media(MediaResult.from_row(row), url)
+                )
+            except BadRequest as e:
+                logging.error(f"[BTN] edit media fail (offline cache): {e}")
+            return
+
+    # ключ/режим/заголовок, которые inline_query уже начал резолвить в фоне
+    pre = await get_prefetched(task_id)
+
     # ─────────────────────────────────────────────────────────
     # Выбор конкретного формата
     if action == "fmt":
-        fmt_id = parts[2] if len(parts) > 2 else None
+        fmt_id = fmt
         if not fmt_id:
             await _set_caption("Формат не распознан.")
             return
 
-        content_key, title = get_content_key_and_title(url)
+        content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
         variant = f"video:fmt={fmt_id}"
 
-        # быстрый кеш-хит
-        row = cache_get_any(content_key, variant)
-        if row:
-            fid = row["file_id"]
-            logging.info(f"[CACHE HIT] {content_key} [{variant}] → {fid}")
-            try:
-                await context.bot.edit_message_media(
-                    inline_message_id=inline_id,
-                    media=InputMediaVideo(media=fid, caption=f"Видео готово: {url}")
-                )
-            except BadRequest as e:
-                logging.error(f"[BTN/fmt] edit media fail (cache): {e}")
-            return
-
-        # защита от дублей
-        lock = get_inflight_lock(content_key, variant)
-        async with lock:
-            # повторная проверка кэша (вдруг другой поток уже скачал)
-            row = cache_get_any(content_key, variant)
-            if row:
-                fid = row["file_id"]
-                logging.info(f"[CACHE HIT/AFTER-LOCK] {content_key} [{variant}] → {fid}")
-                try:
-                    await context.bot.edit_message_media(
-                        inline_message_id=inline_id,
-                        media=InputMediaVideo(media=fid, caption=f"Видео готово: {url}")
-                    )
-                except BadRequest as e:
-                    logging.error(f"[BTN/fmt] edit media fail (cache-after-lock): {e}")
-                return
-
+        async def produce_fmt() -> MediaResult:
             await _set_caption(f"Скачиваю формат {fmt_id}…")
-            video_path = thumb = None
+            video_path = None
             try:
-                async with DL_SEM:
-                    video_path = await _run_io(download_video_with_format, url, fmt_id)
-                size = os.path.getsize(video_path)
-                logging.info(f"[FMT] {fmt_id} → {size} bytes")
-            except Exception as e:
-                logging.error(f"[FMT] primary fail: {e}")
                 try:
-                    async with DL_SEM:
-                        video_path = await _run_io(download_video_smart, url, SMART_FMT_1080)
-                    size = os.path.getsize(video_path)
-                    logging.info(f"[FMT] fallback SMART_FMT_1080 → {size} bytes")
-                except Exception as e2:
-                    logging.error(f"[FMT] fallback fail: {e2}")
-                    await _set_caption("Не удалось скачать выбранный формат.")
-                    return
-
-            # отправляем и кешируем
-            try:
-                if size <= MAX_TG_SIZE:
-                    duration, width, height = await _run_io(get_video_info, video_path)
-                    thumb = await _run_io(generate_thumbnail, video_path)
-                    sent = await context.bot.send_video(
-                        chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
-                        video=open(video_path, "rb"),
-                        duration=duration, width=width, height=height,
-                        thumbnail=InputFile(thumb) if thumb else None,
-                        caption="Кэширование…",
-                    )
-                    file_id = sent.video.file_id
-                    file_unique_id = sent.video.file_unique_id
-                else:
-                    file_id, duration, width, height = await send_via_userbot(
-                        video_path, caption=f"Кэширование… {url}", bot=context.bot
-                    )
-                    file_unique_id = None
-
-                cache_put(
-                    content_key, variant, kind="video",
-                    file_id=file_id, file_unique_id=file_unique_id,
-                    width=width, height=height, duration=duration, size=size,
-                    fmt_used=fmt_id, title=title, source_url=url
-                )
-                logging.info(f"[DB] saved {content_key} [{variant}] → {file_id}")
-
-                await context.bot.edit_message_media(
-                    inline_message_id=inline_id,
-                    media=InputMediaVideo(media=file_id, caption=f"Видео готово: {url}")
-                )
-            except BadRequest as e:
-                logging.error(f"[FMT] edit media fail: {e}")
-                await _set_caption("Не удалось отправить видео. Выбери другой формат:")
+                    async with _slot(NET):
+                        video_path = await _download(f"Скачиваю формат {fmt_id}…", download_video_with_format_async, url, fmt_id, info=await _info())
+                    logging.info(f"[FMT] {fmt_id} → {os.path.getsize(video_path)} bytes")
+                except Exception as e:
+                    logging.error(f"[FMT] primary fail: {e}")
+                    async with _slot(NET):
+                        video_path = await _download("Скачиваю видео (≤1080p)…", download_video_smart_async, url, SMART_FMT_1080)
+                    logging.info(f"[FMT] fallback SMART_FMT_1080 → {os.path.getsize(video_path)} bytes")
+                return await _upload_video(video_path, content_key, variant, title, fmt_id)
             finally:
-                try:
-                    if thumb and os.path.exists(thumb):
-                        os.remove(thumb)
-                    if video_path and os.path.exists(video_path):
-                        os.remove(video_path)
-                except Exception:
-                    pass
+                _remove(video_path)
+
+        try:
+            media = await _obtain(content_key, variant, produce_fmt)
+        except Exception as e:
+            logging.error(f"[FMT] fail: {e}")
+            await _set_caption("Не удалось скачать выбранный формат.")
+            return
+        if not await _deliver(media):
+            await _set_caption("Не удалось отправить видео. Выбери другой формат:")
         return
 
     # ─────────────────────────────────────────────────────────
@@ -232,209 +305,145 @@ async def button_callback(update, context: ContextTypes.DEFAULT_TYPE):
         try:
             if action == "aauto":
                 mode = "audio"
-                content_key, title = get_content_key_and_title(url)
+                content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
             elif action == "vauto":
                 mode = "video"
-                content_key, title = get_content_key_and_title(url)
+                content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
             else:
-                mode, content_key, title = detect_media_kind_and_key(url)
+                mode, content_key, title = (pre.mode, pre.auto_key, pre.title) if pre else await _run_io(detect_media_kind_and_key, url)
 
             logging.info(f"[AUTO] {action} mode={mode} key={content_key}")
 
-            async def reply_cached(kind: str, file_id: str):
-                media = InputMediaVideo(media=file_id, caption=f"Видео готово: {url}") if kind == "video" \
-                        else InputMediaAudio(media=file_id, caption=f"Аудио готово: {url}")
-                await context.bot.edit_message_media(inline_message_id=inline_id, media=media)
-
             # ── ВИДЕО ─────────────────────────────────────────
             if mode == "video":
                 variant = "video:smart1080"
 
-                # быстрый кеш
-                row = cache_get_any(content_key, variant)
-                if row:
-                    fid = row["file_id"]
-                    logging.info(f"[CACHE HIT] {content_key} [{variant}] → {fid}")
-                    await reply_cached("video", fid)
-                    return
-
-                # защита от дублей
-                lock = get_inflight_lock(content_key, variant)
-                async with lock:
-                    row = cache_get_any(content_key, variant)
-                    if row:
-                        fid = row["file_id"]
-                        logging.info(f"[CACHE HIT/AFTER-LOCK] {content_key} [{variant}] → {fid}")
-                        await reply_cached("video", fid)
-                        return
-
+                async def produce_video() -> MediaResult:
                     await _set_caption("Скачиваю видео (≤1080p)…")
-                    video_path = thumb = None
-                    async with DL_SEM:
-                        video_path = await _run_io(download_video_smart, url, SMART_FMT_1080)
-                    size = os.path.getsize(video_path)
-                    logging.info(f"[AUTO/VIDEO] downloaded size={size}")
-
-                    if size <= MAX_TG_SIZE:
-                        duration, width, height = await _run_io(get_video_info, video_path)
-                        thumb = await _run_io(generate_thumbnail, video_path)
-                        sent = await context.bot.send_video(
-                            chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
-                            video=open(video_path, "rb"),
-                            duration=duration, width=width, height=height,
-                            thumbnail=InputFile(thumb) if thumb else None,
-                            caption="Кэширование…",
-                        )
-                        file_id = sent.video.file_id
-                        file_unique_id = sent.video.file_unique_id
-                    else:
-                        file_id, duration, width, height = await send_via_userbot(
-                            video_path, caption=f"Кэширование… {url}", bot=context.bot
-                        )
-                        file_unique_id = None
-
-                    cache_put(
-                        content_key, variant, kind="video",
-                        file_id=file_id, file_unique_id=file_unique_id,
-                        width=width, height=height, duration=duration, size=size,
-                        fmt_used=SMART_FMT_1080, title=title, source_url=url
-                    )
-                    logging.info(f"[DB] saved {content_key} [{variant}] → {file_id}")
-
-                    await reply_cached("video", file_id)
-
+                    video_path = None
                     try:
-                        if thumb and os.path.exists(thumb): os.remove(thumb)
-                        if video_path and os.path.exists(video_path): os.remove(video_path)
-                    except Exception:
-                        pass
+                        async with _slot(NET):
+                            video_path = await _download("Скачиваю видео (≤1080p)…", download_video_smart_async, url, SMART_FMT_1080, info=await _info())
+                        logging.info(f"[AUTO/VIDEO] downloaded size={os.path.getsize(video_path)}")
+                        media = await _upload_video(video_path, content_key, variant, title, SMART_FMT_1080)
+                        # исходник остаётся на диске: аудио/GIF из него — без повторной загрузки
+                        await _run_io(local_store.keep, content_key, video_path)
+                        return media
+                    finally:
+                        _remove(video_path)
+
+                await _deliver(await _obtain(content_key, variant, produce_video))
                 return
 
             # ── АУДИО ─────────────────────────────────────────
-            variant = "audio:mp3"
-
-            # быстрый кеш
-            row = cache_get_any(content_key, variant)
-            if row:
-                fid = row["file_id"]
-                logging.info(f"[CACHE HIT] {content_key} [{variant}] → {fid}")
-                await reply_cached("audio", fid)
-                return
+            variant, produce_audio = _produce_audio(content_key, title, "mp3")
 
-            # защита от дублей
-            lock = get_inflight_lock(content_key, variant)
-            async with lock:
-                row = cache_get_any(content_key, variant)
-                if row:
-                    fid = row["file_id"]
-                    logging.info(f"[CACHE HIT/AFTER-LOCK] {content_key} [{variant}] → {fid}")
-                    await reply_cached("audio", fid)
-                    return
-
-                await _set_caption("Готовлю аудио (mp3)…")
-                async with DL_SEM:
-                    audio_path = await _run_io(download_audio, url, "mp3")
-                title_full, artist = extract_title_artist(url, title)
-                sent = await context.bot.send_audio(
-                    chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
-                    audio=open(audio_path, "rb"),
-                    title=title_full, performer=artist,
-                    caption=f"Аудио готово: {url}",
-                )
-                file_id = sent.audio.file_id
-                cache_put(
-                    content_key, variant, kind="audio",
-                    file_id=file_id, file_unique_id=sent.audio.file_unique_id,
-                    width=None, height=None, duration=getattr(sent.audio, "duration", None),
-                    size=os.path.getsize(audio_path), fmt_used="mp3", title=title_full, source_url=url
-                )
-                logging.info(f"[DB] saved {content_key} [{variant}] → {file_id}")
-
-                await reply_cached("audio", file_id)
+            await _deliver(await _obtain(content_key, variant, produce_audio))
         except Exception as e:
             logging.error(f"[AUTO] fail: {e}")
             from services.keyboard import build_full_format_keyboard
-            kb = build_full_format_keyboard(task_id, url)
+            kb = await _run_io(build_full_format_keyboard, task_id, url, known_key)
             await _set_caption("Не удалось автовыбрать. Выбери формат:", kb)
-        finally:
-            try:
-                if 'audio_path' in locals() and audio_path and os.path.exists(audio_path):
-                    os.remove(audio_path)
-            except Exception:
-                pass
+        return
+
+    # ─────────────────────────────────────────────────────────
+    # Аудио в выбранном контейнере (mp3/m4a из «Больше»)
+    if action == "aud":
+        if fmt not in _AUDIO_FORMATS:
+            await _set_caption("Формат не распознан.")
+            return
+        content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
+        variant, produce_audio = _produce_audio(content_key, title, fmt)
+        try:
+            media = await _obtain(content_key, variant, produce_audio)
+        except Exception as e:
+            logging.error(f"[AUD] fail: {e}")
+            await _set_caption("Не удалось получить аудио.")
+            return
+        if not await _deliver(media):
+            await _set_caption("Не удалось отправить аудио.")
         return
 
     # ─────────────────────────────────────────────────────────
     # GIF (тихий MP4 для sendAnimation)
     if action == "gif":
-        content_key, title = get_content_key_and_title(url)
+        content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
         variant = "anim:50"
 
-        # быстрый кеш
-        row = cache_get_any(content_key, variant)
-        if row:
-            fid = row["file_id"]
-            logging.info(f"[CACHE HIT] {content_key} [{variant}] → {fid}")
-            try:
-                await context.bot.edit_message_media(
-                    inline_message_id=inline_id,
-                    media=InputMediaAnimation(media=fid, caption=f"GIF готова: {url}")
-                )
-            except BadRequest as e:
-                logging.error(f"[GIF] edit media fail (cache): {e}")
-            return
-
-        # защита от дублей
-        lock = get_inflight_lock(content_key, variant)
-        async with lock:
-            row = cache_get_any(content_key, variant)
-            if row:
-                fid = row["file_id"]
-                logging.info(f"[CACHE HIT/AFTER-LOCK] {content_key} [{variant}] → {fid}")
-                try:
-                    await context.bot.edit_message_media(
-                        inline_message_id=inline_id,
-                        media=InputMediaAnimation(media=fid, caption=f"GIF готова: {url}")
-                    )
-                except BadRequest as e:
-                    logging.error(f"[GIF] edit media fail (cache-after-lock): {e}")
-                return
-
+        async def produce_gif() -> MediaResult:
             await _set_caption("Готовлю GIF…")
-            src = anim = None
+            anim, src = await _derive(content_key, "Готовлю GIF…", video_to_tg_animation, 50)
             try:
-                async with DL_SEM:
-                    src = await _run_io(download_video_with_format, url, "bv*[height<=480]+ba/b[height<=480]/b")
-                async with DL_SEM:
-                    anim = await _run_io(video_to_tg_animation, src, 50)
-
-                sent = await context.bot.send_animation(
+                sent = await _upload(context.bot.send_animation(
                     chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
                     animation=open(anim, "rb"), caption=f"GIF готова: {url}",
-                )
-                file_id = sent.animation.file_id
-                cache_put(
+                ))
+                a = sent.animation
+                await cache_put(
                     content_key, variant, kind="animation",
-                    file_id=file_id, file_unique_id=sent.animation.file_unique_id,
-                    width=sent.animation.width, height=sent.animation.height,
-                    duration=sent.animation.duration, size=os.path.getsize(anim),
+                    file_id=a.file_id, file_unique_id=a.file_unique_id,
+                    width=a.width, height=a.height,
+                    duration=a.duration, size=os.path.getsize(anim),
                     fmt_used="anim50", title=title, source_url=url
                 )
-                logging.info(f"[DB] saved {content_key} [{variant}] → {file_id}")
+                logging.info(f"[DB] saved {content_key} [{variant}] → {a.file_id}")
+                return MediaResult("animation", a.file_id, a.width, a.height, a.duration)
+            finally:
+                _remove(src, anim)
 
-                await context.bot.edit_message_media(
-                    inline_message_id=inline_id,
-                    media=InputMediaAnimation(media=file_id, caption=f"GIF готова: {url}")
+        try:
+            media = await _obtain(content_key, variant, produce_gif)
+        except Exception as e:
+            logging.error(f"[GIF] fail: {e}")
+            await _set_caption("Не удалось получить GIF.")
+            return
+        if not await _deliver(media):
+            await _set_caption("Не удалось получить GIF.")
+        return
+
+    # ─────────────────────────────────────────────────────────
+    # GIF-файл (настоящий .gif документом — для тех, кому нужен именно файл)
+    if action == "giffile":
+        content_key, title = (pre.content_key, pre.title) if pre else await _run_io(get_content_key_and_title, url)
+        variant = "gif:file"
+
+        async def produce_gif_file() -> MediaResult:
+            await _set_caption("Готовлю GIF-файл…")
+            gif, src = await _derive(content_key, "Готовлю GIF-файл…", video_to_gif)
+            try:
+                with open(gif, "rb") as f:
+                    sent = await _upload(context.bot.send_document(
+                        chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
+                        document=f, caption=f"GIF готова: {url}",
+                        disable_content_type_detection=True,
+                    ))
+                # Telegram может сам перепаковать .gif в анимацию — тогда храним как анимацию
+                if sent.animation:
+                    a = sent.animation
+                    media = MediaResult("animation", a.file_id, a.width, a.height, a.duration)
+                else:
+                    a = sent.document
+                    media = MediaResult("document", a.file_id)
+                await cache_put(
+                    content_key, variant, kind=media.kind,
+                    file_id=a.file_id, file_unique_id=a.file_unique_id,
+                    width=media.width, height=media.height,
+                    duration=media.duration, size=os.path.getsize(gif),
+                    fmt_used="gif", title=title, source_url=url
                 )
-            except Exception as e:
-                logging.error(f"[GIF] fail: {e}")
-                await _set_caption("Не удалось получить GIF.")
+                logging.info(f"[DB] saved {content_key} [{variant}] → {a.file_id}")
+                return media
             finally:
-                for p in (src, anim):
-                    try:
-                        if p and os.path.exists(p): os.remove(p)
-                    except Exception:
-                        pass
+                _remove(src, gif)
+
+        try:
+            media = await _obtain(content_key, variant, produce_gif_file)
+        except Exception as e:
+            logging.error(f"[GIF] file fail: {e}")
+            await _set_caption("Не удалось получить GIF.")
+            return
+        if not await _deliver(media):
+            await _set_caption("Не удалось получить GIF.")
         return
 
     # ─────────────────────────────────────────────────────────
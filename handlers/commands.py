@@ -2,6 +2,13 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from handlers.files_id import send_file_ids
+from services.meta_cache import meta_stats
+from services.cache_db import db_stats, hot_stats
+from services.local_store import store_stats
+from utils.text import format_bytes
+from services.scheduler import scheduler
+from services.task_store import task_stats
+from handlers.inline import inline_stats
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Используй инлайн @бота или пришли ссылку")
@@ -13,4 +20,45 @@ async def id_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("Ответь этой командой на сообщение с файлом/медиа.")
         return
     fake_update = Update(update.update_id, message=msg.reply_to_message)
-    await send_file_ids(fake_update, context)
\ No newline at end of file
+    await send_file_ids(fake_update, context)
+
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    lines = []
+    proc = context.application.update_processor
+    if hasattr(proc, "dispatch_stats"):
+        st = proc.dispatch_stats()
+        lines.append(
+            f"Апдейты: {st['updates']}, в работе {st['in_flight']}/{proc.max_concurrent}, "
+            f"ожидание avg {st['wait_avg']:.2f}s / max {st['wait_max']:.2f}s"
+        )
+    for name, q in scheduler.stats().items():
+        lines.append(
+            f"Пул {name}: {q['running']}/{q['slots']}, в очереди {q['queued']}, "
+            f"ожидание avg {q['wait_avg']:.1f}s / max {q['wait_max']:.1f}s"
+        )
+    i = inline_stats()
+    lines.append(
+        f"Инлайн: запросов {i['queries']}, ответов {i['answered']}, не ссылка {i['not_url']}, "
+        f"схлопнуто {i['debounced']}, повтор ссылки {i['reused']}"
+    )
+    t = task_stats()
+    lines.append(f"Инлайн-задачи: в памяти {t['in_memory']}, ждут записи {t['pending']}")
+    m = meta_stats()
+    lines.append(
+        f"Кэш метаданных: lru {m['lru_hit']}, db {m['db_hit']}, miss {m['miss']}, "
+        f"err {m['error']}, hit-rate {m['hit_rate']:.0%}"
+    )
+    d = db_stats()
+    lines.append(
+        f"cache.db: чтений {d['reads']}, записей {d['writes']} за {d['commits']} коммитов "
+        f"(пачка до {d['batch_max']}), в очереди {d['write_queue']}"
+    )
+    h = hot_stats()
+    lines.append(
+        f"Горячий кэш: {h['size']} строк, hit {h['hit']}, neg {h['neg_hit']}, "
+        f"join {h['joined']}, miss {h['miss']}, hit-rate {h['hit_rate']:.0%}"
+    )
+    st = store_stats()
+    lines.append(f"Локальные исходники: {st['files']} файлов, {format_bytes(st['bytes'])}, в работе {st['leased']}")
+    await update.effective_message.reply_text("\n".join(lines))
\ No newline at end of file
@@ -1,33 +1,182 @@
 # handlers/inline.py
-import logging
+import asyncio, itertools, logging, time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
 from uuid import uuid4
-from telegram import InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultCachedPhoto
+from telegram import (
+    InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultCachedPhoto,
+    InlineQueryResultCachedVideo, InlineQueryResultCachedAudio, InlineQueryResultCachedGif,
+    InlineQueryResultCachedDocument,
+)
 from telegram.error import BadRequest
 from telegram.ext import ContextTypes
-from state import DOWNLOAD_TASKS
-from config import PLACEHOLDER_PHOTO_ID
+from services.task_store import put_task
+from config import PLACEHOLDER_PHOTO_ID, INLINE_DEBOUNCE, INLINE_REUSE_TTL, INLINE_REUSE_MAX, INLINE_CACHE_TIME
+from services.prefetch import schedule_prefetch
+from services.cache_db import alias_get, cache_variants, cache_search
+from utils.callback_data import encode_callback
+from utils.url_keys import offline_content_key, normalize_url
 
-def _mini_kb(task: str) -> InlineKeyboardMarkup:
+# user_id -> (когда пришёл последний запрос, его номер): для схлопывания набора текста
+_typing: Dict[int, Tuple[float, int]] = {}
+_seq = itertools.count()
+# (user_id, нормализованный URL) -> (task_id, годен до): повтор той же ссылки тем же юзером —
+# тот же task. Между юзерами task не делим: prefetch снимает прошлый task юзера, когда тот
+# вставляет новую ссылку, и общий task выбил бы предвыборку у соседа (сам probe и так общий по URL).
+_recent: "OrderedDict[Tuple[int, str], Tuple[str, float]]" = OrderedDict()
+
+INLINE_STATS = {"queries": 0, "not_url": 0, "debounced": 0, "reused": 0, "answered": 0, "searches": 0}
+
+# короче — не ищем (на 1 букву FTS вернёт полбазы)
+_MIN_SEARCH_LEN = 3
+
+
+def _looks_like_url(text: str) -> bool:
+    """Дешёвый фильтр недопечатанного: схема http(s) и хост с точкой."""
+    if not text.startswith(("http://", "https://")) or any(c.isspace() for c in text):
+        return False
+    try:
+        host = urlparse(text).hostname or ""
+    except ValueError:
+        return False
+    return "." in host and not host.endswith(".")
+
+
+async def _debounce(user_id: int) -> bool:
+    """True — этот запрос последний от юзера; False — пока ждали, он допечатал ещё."""
+    loop = asyncio.get_running_loop()
+    now = loop.time()
+    prev = _typing.get(user_id)
+    me = next(_seq)
+    _typing[user_id] = (now, me)
+    if len(_typing) > INLINE_REUSE_MAX:
+        for uid in [u for u, (at, _) in _typing.items() if now - at >= INLINE_DEBOUNCE]:
+            del _typing[uid]
+    if prev is None or now - prev[0] >= INLINE_DEBOUNCE:
+        return True  # вставил ссылку разом — отвечаем без задержки
+    await asyncio.sleep(INLINE_DEBOUNCE)
+    return _typing.get(user_id, (0, me))[1] == me
+
+
+def _task_for(user_id: int, url: str) -> Tuple[str, bool]:
+    """(task_id, новый ли) — в окне INLINE_REUSE_TTL одна ссылка одного юзера = один task."""
+    now = time.monotonic()
+    slot = (user_id, normalize_url(url))
+    hit = _recent.get(slot)
+    if hit and hit[1] > now:
+        _recent.move_to_end(slot)
+        return hit[0], False
+    task = uuid4().hex[:8]
+    _recent[slot] = (task, now + INLINE_REUSE_TTL)
+    _recent.move_to_end(slot)
+    while len(_recent) > INLINE_REUSE_MAX:
+        _recent.popitem(last=False)
+    return task, True
+
+
+def inline_stats() -> Dict[str, int]:
+    return dict(INLINE_STATS, typing=len(_typing), recent_urls=len(_recent))
+
+
+def _mini_kb(task: str, key: Optional[str]) -> InlineKeyboardMarkup:
+    # ключ, если он уже известен, едет прямо в кнопке
     return InlineKeyboardMarkup([
         [
-            InlineKeyboardButton("⚡ Автовыбор", callback_data=f"auto|{task}"),
-            InlineKeyboardButton("🎬 Видео",     callback_data=f"vauto|{task}"),
+            InlineKeyboardButton("⚡ Автовыбор", callback_data=encode_callback("auto", task, key)),
+            InlineKeyboardButton("🎬 Видео",     callback_data=encode_callback("vauto", task, key)),
         ],
         [
-            InlineKeyboardButton("🎵 Аудио",     callback_data=f"aauto|{task}"),
-            InlineKeyboardButton("➕ Больше",     callback_data=f"more|{task}"),
+            InlineKeyboardButton("🎵 Аудио",     callback_data=encode_callback("aauto", task, key)),
+            InlineKeyboardButton("➕ Больше",     callback_data=encode_callback("more", task, key)),
         ],
     ])
 
+def _variant_label(variant: str) -> str:
+    if variant == "video:smart1080":
+        return "🎬 Видео (авто)"
+    if variant.startswith("video:fmt="):
+        return f"🎬 Видео ({variant.split('=', 1)[1]})"
+    if variant.startswith("audio:"):
+        return f"🎵 Аудио ({variant.split(':', 1)[1]})"
+    if variant.startswith("anim:"):
+        return "🎞 GIF"
+    if variant.startswith("gif:"):
+        return "🖼 GIF-файл"
+    return variant
+
+
+def _cached_results(prefix: str, rows, url: Optional[str] = None) -> list:
+    """Готовые file_id — сразу результатами инлайна: без кнопок и edit_message_media."""
+    out = []
+    for i, row in enumerate(rows):
+        rid = f"{prefix}:{i}"
+        label = _variant_label(row["variant_key"])
+        if url is None:
+            # поиск: у каждой строки своя ссылка, а название — главное в выдаче
+            label = f"{label} · {row['title']}" if row["title"] else label
+        if row["kind"] == "audio":
+            out.append(InlineQueryResultCachedAudio(
+                id=rid, audio_file_id=row["file_id"], caption=f"Аудио готово: {url or row['source_url']}"))
+        elif row["kind"] == "animation":
+            out.append(InlineQueryResultCachedGif(
+                id=rid, gif_file_id=row["file_id"], title=label, caption=f"GIF готова: {url or row['source_url']}"))
+        elif row["kind"] == "document":
+            out.append(InlineQueryResultCachedDocument(
+                id=rid, document_file_id=row["file_id"], title=label,
+                description=row["title"] or None, caption=f"GIF готова: {url or row['source_url']}"))
+        elif row["kind"] == "video":
+            out.append(InlineQueryResultCachedVideo(
+                id=rid, video_file_id=row["file_id"], title=label,
+                description=row["title"] or None, caption=f"Видео готово: {url or row['source_url']}"))
+    return out
+
+
+async def _answer_search(update, text: str):
+    """Не ссылка — ищем по названиям уже закэшированного и отдаём file_id из базы."""
+    INLINE_STATS["searches"] += 1
+    try:
+        rows = await cache_search(text, limit=20)
+    except Exception as e:
+        logging.warning(f"[INLINE] search {text!r} failed: {e}")
+        return
+    try:
+        await update.inline_query.answer(_cached_results("q", rows), cache_time=INLINE_CACHE_TIME, is_personal=False)
+        INLINE_STATS["answered"] += 1
+        logging.info(f"[INLINE] search {text!r} → {len(rows)} cached")
+    except BadRequest as e:
+        logging.error(f"[INLINE] search answer failed: {e}")
+
+
 async def inline_query(update, context: ContextTypes.DEFAULT_TYPE):
     url = (update.inline_query.query or "").strip()
-    if not url.startswith("http"):
+    user_id = update.inline_query.from_user.id
+    INLINE_STATS["queries"] += 1
+    if not _looks_like_url(url):
+        if url.startswith("http") or len(url) < _MIN_SEARCH_LEN:
+            INLINE_STATS["not_url"] += 1  # недопечатанная ссылка или слишком коротко
+            return
+        if not await _debounce(user_id):
+            INLINE_STATS["debounced"] += 1
+            return
+        await _answer_search(update, url)
+        return
+    if not await _debounce(user_id):
+        INLINE_STATS["debounced"] += 1
         return
 
-    task = uuid4().hex[:8]
-    DOWNLOAD_TASKS[task] = url
+    task, fresh = _task_for(user_id, url)
+    if fresh:
+        put_task(task, url)
+    else:
+        INLINE_STATS["reused"] += 1
+    # пока юзер смотрит на клавиатуру — резолвим ключ/режим в фоне; и для повтора тоже:
+    # после другой ссылки prefetch этот task уже снял, а probe по URL всё равно общий
+    schedule_prefetch(task, url, user_id)
 
-    kb = _mini_kb(task)
+    key = offline_content_key(url) or await alias_get(url)
+    cached = _cached_results(task, await cache_variants(key), url) if key else []
+    kb = _mini_kb(task, key)
 
     # ВАЖНО: здесь используем валидный для ЭТОГО бота file_id!
     result = InlineQueryResultCachedPhoto(
@@ -37,9 +186,19 @@ async def inline_query(update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=kb,
     )
     try:
-        await update.inline_query.answer([result], cache_time=0, is_personal=True)
-        logging.info(f"[INLINE] task={task} show mini-menu for {url}")
+        # сначала готовое, меню — для остальных вариантов
+        await update.inline_query.answer(cached + [result], cache_time=INLINE_CACHE_TIME, is_personal=True)
+        INLINE_STATS["answered"] += 1
+        logging.info(f"[INLINE] task={task} show mini-menu for {url} (+{len(cached)} cached)")
     except BadRequest as e:
+        if cached:
+            # битый/чужой file_id в кэше валит весь ответ — отдаём хотя бы меню
+            logging.warning(f"[INLINE] cached results rejected ({e}), retry with menu only")
+            try:
+                await update.inline_query.answer([result], cache_time=INLINE_CACHE_TIME, is_personal=True)
+                return
+            except BadRequest as e2:
+                e = e2
         logging.error(f"[INLINE] CachedPhoto failed: {e}")
         # Можно ничего не отдавать; либо сделать Article-фоллбек,
         # но помни: Article нельзя потом превратить в медиа edit_message_media.
@@ -2,20 +2,62 @@ import os, subprocess
 import re, hashlib
 import logging, json
 import asyncio
+from typing import List, NamedTuple, Optional
 import state
-from telegram import Update, InputFile
+from telegram import Update, InputMediaVideo, MessageEntity
 from telegram.ext import ContextTypes
 
-from config import SMART_FMT_1080, MAX_TG_SIZE, DL_SEM
-from services.ytdlp import download_video_smart
-from services.video import get_video_info, generate_thumbnail
-from services.pyro_send import send_via_userbot
+from config import SMART_FMT_1080, ALBUM_WAIT
+from services.ytdlp import download_video_smart_async
+from services.progress import ProgressCaption
+from services.scheduler import scheduler, estimate_cost, NET
+from services.meta_cache import peek_info
+from services.media_pipeline import obtain, upload_video
+from services import local_store
+from services.singleflight import MediaResult
 from services.content_key import get_content_key_and_title
+from services.cache_db import alias_get
 from utils.text import format_bytes
+from utils.url_keys import offline_content_key, normalize_url
 
 # Регулярка для извлечения URL
 URL_RE = re.compile(r"https?://\S+")
 
+ALBUM_MAX = 10    # лимит Telegram на media group
+
+
+# тот же вариант, что у инлайн-кнопки «Видео» — общий кэш
+DM_VARIANT = "video:smart1080"
+
+
+class _Ready(NamedTuple):
+    url: str
+    media: MediaResult
+
+
+def extract_urls(msg, text: str) -> List[str]:
+    """Все ссылки сообщения: сущности url/text_link, иначе регуляркой по тексту."""
+    urls = []
+    for ents in (msg.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK]),
+                 msg.parse_caption_entities([MessageEntity.URL, MessageEntity.TEXT_LINK])):
+        for ent, value in ents.items():
+            urls.append(ent.url if ent.type == MessageEntity.TEXT_LINK else value)
+    if not urls:
+        # границы знает только Telegram; у регулярки хвостовая пунктуация текста — не часть ссылки
+        urls = [u.rstrip(").,!?;:»\"'") for u in URL_RE.findall(text)]
+    return [u for u in urls if u.startswith(("http://", "https://"))]
+
+
+async def _dedupe(urls: List[str]) -> List[str]:
+    """Одна ссылка на контент: ключ без yt-dlp (парсер/алиасы), иначе нормализованный URL."""
+    seen, out = set(), []
+    for u in urls:
+        key = offline_content_key(u) or await alias_get(u) or normalize_url(u)
+        if key not in seen:
+            seen.add(key)
+            out.append(u)
+    return out
+
 def detect_media_kind_and_key(url: str):
     """
     -> (mode, content_key, title)
@@ -43,6 +85,131 @@ def detect_media_kind_and_key(url: str):
         key, title = get_content_key_and_title(url)
         return "unknown", key, title
 
+async def _fetch(url: str, user_id: Optional[int], bot, on_progress=None) -> _Ready:
+    """file_id для ссылки: из cache.db, из чужой идущей загрузки или своей загрузкой с заливом в кэш."""
+    content_key = offline_content_key(url) or await alias_get(url)
+    title = None
+    if not content_key:
+        content_key, title = await asyncio.to_thread(get_content_key_and_title, url)
+    # один раз и не в event loop: meta.db + zlib + json
+    info = await asyncio.to_thread(peek_info, url)
+    cost = estimate_cost(info)
+
+    async def produce() -> MediaResult:
+        video_path = None
+        try:
+            async with scheduler.slot(NET, user_id=user_id, cost=cost, label="dm"):
+                # async yt-dlp: не блокирует loop, зависание обрывается по дедлайну
+                video_path = await download_video_smart_async(
+                    url, SMART_FMT_1080, info=info, on_progress=on_progress
+                )
+            logging.info(f"[SEND] {url}: {format_bytes(os.path.getsize(video_path))}")
+            media = await upload_video(
+                bot, video_path, content_key, DM_VARIANT,
+                title=title or (info or peek_info(url, memory_only=True) or {}).get("title"), fmt_used=SMART_FMT_1080, url=url,
+                user_id=user_id, cost=cost,
+            )
+            # исходник остаётся на диске: аудио/GIF по этой же ссылке — без повторной загрузки
+            await asyncio.to_thread(local_store.keep, content_key, video_path)
+            return media
+        finally:
+            _cleanup(video_path)
+
+    return _Ready(url, await obtain(content_key, DM_VARIANT, produce))
+
+
+def _cleanup(*paths):
+    for p in paths:
+        try:
+            if p and os.path.exists(p):
+                os.remove(p)
+        except Exception:
+            pass
+
+
+async def _send(msg, items: List[_Ready]):
+    """Одно готовое — обычным видео, несколько — альбомом; всё по file_id, без повторной заливки."""
+    if len(items) == 1:
+        r = items[0]
+        await msg.reply_video(
+            video=r.media.file_id, caption=f"Видео готово: {r.url}",
+            duration=r.media.duration, width=r.media.width, height=r.media.height,
+        )
+        return
+    await msg.reply_media_group(media=[
+        InputMediaVideo(
+            media=r.media.file_id, caption=f"Видео готово: {r.url}",
+            duration=r.media.duration, width=r.media.width, height=r.media.height,
+        )
+        for r in items
+    ])
+
+
+async def _run_batch(msg, status, urls: List[str], user_id: Optional[int], bot):
+    """Все ссылки параллельно (очередь — планировщик), готовые уходят альбомами по ≤10."""
+    ready: "asyncio.Queue[Optional[_Ready]]" = asyncio.Queue()
+    errors: List[str] = []
+    done = 0
+    single = len(urls) == 1
+    # одна ссылка — живой прогресс в статусе; у пачки — счётчик; оба через общий троттлинг правок
+    progress = ProgressCaption(status.edit_text, "Скачиваю...")
+
+    async def one(url: str):
+        nonlocal done
+        try:
+            await ready.put(await _fetch(url, user_id, bot, progress if single else None))
+        except Exception as e:
+            logging.error(f"[БОТ] {url}: {e}")
+            errors.append(f"{url}: {e}" if len(urls) > 1 else str(e))
+        finally:
+            done += 1
+            if not single:
+                await progress.show(f"Скачиваю {len(urls)} ссылок… готово {done}/{len(urls)}")
+
+    async def all_done():
+        await asyncio.gather(*(one(u) for u in urls))
+        await ready.put(None)
+
+    producer = asyncio.create_task(all_done())
+    sent = 0
+    try:
+        finished = False
+        while not finished:
+            item = await ready.get()
+            if item is None:
+                break
+            batch = [item]
+            # ждём, не дозреет ли кто-то ещё, — но не дольше ALBUM_WAIT
+            while len(batch) < ALBUM_MAX:
+                try:
+                    nxt = await asyncio.wait_for(ready.get(), timeout=ALBUM_WAIT)
+                except asyncio.TimeoutError:
+                    break
+                if nxt is None:
+                    finished = True
+                    break
+                batch.append(nxt)
+            if single:
+                await progress.aclose()
+            try:
+                await _send(msg, batch)
+                sent += len(batch)
+            except Exception as e:
+                logging.error(f"[БОТ] send fail: {e}")
+                errors.extend(f"{r.url}: {e}" for r in batch)
+    finally:
+        if not producer.done():
+            producer.cancel()
+        await progress.aclose()
+
+    if errors and len(urls) == 1:
+        await status.edit_text(f"Ошибка: {errors[0]}")
+    elif errors:
+        await status.edit_text(f"Готово {sent}/{len(urls)}. Ошибки:\n" + "\n".join(errors)[:3500])
+    else:
+        await status.edit_text("Готово!")
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # игнорим сообщения, которые прислал аккаунт юзербота (чтобы не ловить свой же DM)
     if update.effective_user and state.USERBOT_ID and update.effective_user.id == state.USERBOT_ID:
@@ -69,46 +236,14 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         text = text.replace(f"@{bot_username}", "").strip()
 
-    url = text
-    logging.info(f"[БОТ] Ссылка: {url}")
-    status = await msg.reply_text("Скачиваю...")
-
-    video_path = None
+    urls = await _dedupe(extract_urls(msg, text))
+    if not urls:
+        return
+    logging.info(f"[БОТ] Ссылки ({len(urls)}): {urls}")
+    status = await msg.reply_text("Скачиваю..." if len(urls) == 1 else f"Скачиваю {len(urls)} ссылок…")
+    user_id = update.effective_user.id if update.effective_user else None
     try:
-        async with DL_SEM:
-            # выносим скачивание в отдельный поток
-            video_path = await asyncio.to_thread(download_video_smart, url, SMART_FMT_1080)
-
-        size = os.path.getsize(video_path)
-        logging.info(f"[SEND] Итоговый файл {format_bytes(size)} (лимит {format_bytes(MAX_TG_SIZE)})")
-
-        if size > MAX_TG_SIZE:
-            logging.info("[SEND] >50MB — отправляем через юзербота")
-            file_id, duration, width, height = await send_via_userbot(
-                video_path, caption=f"Кэширование… {url}", bot=context.bot
-            )
-            await status.edit_text("Готово!")
-            await update.effective_message.reply_video(video=file_id, caption=f"Видео готово: {url}")
-        else:
-            await status.edit_text("Готово!")
-            duration, width, height = get_video_info(video_path)
-            thumb = generate_thumbnail(video_path)
-            await update.effective_message.reply_video(
-                video=open(video_path, "rb"),
-                caption=f"Видео готово: {url}",
-                duration=duration,
-                width=width,
-                height=height,
-                thumbnail=InputFile(thumb) if thumb else None,
-            )
-
+        await _run_batch(msg, status, urls, user_id, context.bot)
     except Exception as e:
         logging.error(f"[БОТ] Ошибка: {e}")
         await status.edit_text(f"Ошибка: {e}")
-
-    finally:
-        try:
-            if video_path and os.path.exists(video_path):
-                os.remove(video_path)
-        except Exception:
-            pass
@@ -0,0 +1,66 @@
+# scripts/bench_animation.py
+# Сравнение старой CRF-лестницы и нового одно-проходного video_to_tg_animation:
+# время и размер на наборе роликов.
+#
+#   python -m scripts.bench_animation clips/*.mp4 --target-mb 50
+#
+# Запускать из корня репозитория с теми же переменными окружения, что и бота (нужен config).
+import argparse, asyncio, os, shutil, subprocess, tempfile, time
+from config import FFMPEG_TIMEOUT
+from services.video import video_to_tg_animation
+from utils.text import format_bytes
+
+# как было до однопроходного кодировщика: полный прогон на каждую ступень
+_LADDER = [(480, 30, 23), (360, 30, 24), (320, 24, 26)]
+
+
+def ladder_animation(in_path: str, target_mb: int) -> tuple:
+    out = os.path.splitext(in_path)[0] + ".ladder.mp4"
+    encodes = 0
+    for w, fps, crf in _LADDER:
+        encodes += 1
+        subprocess.run([
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", in_path, "-an",
+            "-vf", f"scale=min({w}\\,iw):-2:flags=lanczos,fps={fps}",
+            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "baseline",
+            "-movflags", "+faststart", "-crf", str(crf), out,
+        ], check=True, timeout=FFMPEG_TIMEOUT)
+        if os.path.getsize(out) <= target_mb * 1024 * 1024:
+            break
+    return out, encodes
+
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    res = fn(*args)
+    return res, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="ladder vs one-pass animation encoder")
+    ap.add_argument("clips", nargs="+")
+    ap.add_argument("--target-mb", type=int, default=50)
+    args = ap.parse_args()
+    limit = args.target_mb * 1024 * 1024
+
+    print(f"{'clip':<32} {'ladder':>22} {'one-pass':>22}")
+    tot_old = tot_new = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for clip in args.clips:
+            # каждому кодировщику своя копия: выходные имена строятся от входного
+            a = shutil.copy(clip, os.path.join(tmp, "a_" + os.path.basename(clip)))
+            b = shutil.copy(clip, os.path.join(tmp, "b_" + os.path.basename(clip)))
+            (old, encodes), t_old = _timed(ladder_animation, a, args.target_mb)
+            new, t_new = _timed(lambda: asyncio.run(video_to_tg_animation(b, args.target_mb)))
+            s_old, s_new = os.path.getsize(old), os.path.getsize(new)
+            tot_old += t_old
+            tot_new += t_new
+            print(f"{os.path.basename(clip)[:32]:<32} "
+                  f"{t_old:6.1f}s {format_bytes(s_old):>9}{'!' if s_old > limit else ' '}x{encodes} "
+                  f"{t_new:6.1f}s {format_bytes(s_new):>9}{'!' if s_new > limit else ' '}")
+    print(f"{'total':<32} {tot_old:6.1f}s {'':>15}{tot_new:6.1f}s")
+    print("! — больше лимита")
+
+
+if __name__ == "__main__":
+    main()
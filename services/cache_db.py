@@ -1,17 +1,227 @@
-import sqlite3, logging
-from typing import Optional
-from config import DB_PATH
+# services/cache_db.py
+# Кэш file_id в SQLite (WAL). Event loop никогда не трогает диск сам:
+# чтения идут через небольшой пул потоков, у каждого своё соединение;
+# записи — в один поток-писатель, который сливает накопившуюся очередь
+# одной транзакцией (group commit: один fsync на пачку, а не на строку).
+# Перед cache_get — горячий LRU строк, промахи тоже помнятся (недолго).
+import asyncio, logging, queue, sqlite3, threading, time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from config import DB_PATH, DB_READERS, DB_WRITE_BATCH, CACHE_HOT_SIZE, CACHE_NEG_TTL, CACHE_WARM_ROWS
+from services.singleflight import SingleFlight
+from utils.url_keys import canon_key, normalize_url
 
+# одни и те же строки SQL → sqlite3 держит их подготовленными в cached_statements
+_SQL_GET = "SELECT * FROM cache WHERE content_key=? AND variant_key=?"
+_SQL_PUT = """
+    INSERT OR REPLACE INTO cache(content_key, variant_key, kind, file_id, file_unique_id,
+        width, height, duration, size, fmt_used, title, artist, source_url)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+# cache_fts — external content над cache: старую строку вычёркиваем до REPLACE, новую вписываем после
+_SQL_FTS_DEL = """
+    INSERT INTO cache_fts(cache_fts, rowid, title, artist, source_url)
+    SELECT 'delete', rowid, title, artist, source_url FROM cache WHERE content_key=? AND variant_key=?
+"""
+_SQL_FTS_ADD = """
+    INSERT INTO cache_fts(rowid, title, artist, source_url)
+    SELECT rowid, title, artist, source_url FROM cache WHERE content_key=? AND variant_key=?
+"""
+_SQL_SEARCH = """
+    SELECT cache.* FROM cache_fts JOIN cache ON cache.rowid = cache_fts.rowid
+    WHERE cache_fts MATCH ? ORDER BY bm25(cache_fts, 10.0, 5.0, 1.0) LIMIT ?
+"""
 
-_conn: Optional[sqlite3.Connection] = None
+_Stmt = Tuple[str, Sequence[Any]]
+_WriteJob = Tuple[List[_Stmt], Future]  # операторы одной записи — всегда в одной транзакции
+
+_local = threading.local()
+_readers: Optional[ThreadPoolExecutor] = None
+_writer: Optional["_Writer"] = None
+
+STATS = {"reads": 0, "writes": 0, "commits": 0, "batch_max": 0}
+
+# (content_key, variant_key) -> (годен до | None — бессрочно, строка | None — промах)
+_hot: "OrderedDict[Tuple[str, str], Tuple[Optional[float], Optional[sqlite3.Row]]]" = OrderedDict()
+# одновременные промахи по одному ключу — один запрос в SQLite
+_lookups = SingleFlight()
+_generation = 0  # растёт при каждой инвалидации: ответ, начатый до неё, в кэш не кладём
+HOT_STATS = {"hit": 0, "neg_hit": 0, "miss": 0, "joined": 0}
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=64)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    # в WAL NORMAL не теряет целостность, только последние транзакции при сбое питания
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _reader_conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = _connect()
+    return conn
+
+
+class _Writer(threading.Thread):
+    def __init__(self):
+        super().__init__(name="cache-db-writer", daemon=True)
+        self.jobs: "queue.Queue[Optional[_WriteJob]]" = queue.Queue()
+
+    def submit(self, stmts: List[_Stmt]) -> Future:
+        fut: Future = Future()
+        self.jobs.put((stmts, fut))
+        return fut
+
+    def run(self):
+        conn = _connect()
+        stop = False
+        while not stop:
+            job = self.jobs.get()
+            if job is None:
+                break
+            batch: List[_WriteJob] = [job]
+            # всё, что успело накопиться, — в ту же транзакцию
+            while len(batch) < DB_WRITE_BATCH:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+            self._commit(conn, batch)
+        conn.close()
+
+    @staticmethod
+    def _commit(conn: sqlite3.Connection, batch: List[_WriteJob]):
+        try:
+            with conn:
+                results = [[conn.execute(sql, params).rowcount for sql, params in stmts][-1]
+                           for stmts, _ in batch]
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                return
+            # одна плохая запись не должна ронять соседей — повторяем поштучно
+            logging.warning(f"[DB] batch of {len(batch)} failed ({e}), retrying one by one")
+            for job in batch:
+                _Writer._commit(conn, [job])
+            return
+        STATS["writes"] += len(batch)
+        STATS["commits"] += 1
+        STATS["batch_max"] = max(STATS["batch_max"], len(batch))
+        for (_, fut), res in zip(batch, results):
+            fut.set_result(res)
+
+
+# ── миграции ─────────────────────────────────────────────
+# (версия, название, fn(conn)); выполняются по порядку в db_init, каждая — своей транзакцией
+
+def _m1_canon_keys(conn: sqlite3.Connection):
+    """"YouTube:<id>" (старый бот) и "youtube:<id>" → один канонический ключ, дубли — по свежести."""
+    rows = conn.execute("SELECT rowid, content_key, variant_key, created_at FROM cache").fetchall()
+    best: Dict[Tuple[str, str], Tuple[Tuple[str, int], int]] = {}
+    for rowid, key, variant, created_at in rows:
+        pair = (canon_key(key), variant)
+        rank = (created_at or "", rowid)
+        if pair not in best or rank > best[pair][0]:
+            best[pair] = (rank, rowid)
+    keep = {rowid: pair[0] for pair, (_, rowid) in best.items()}
+    dropped = [(rowid,) for rowid, _, _, _ in rows if rowid not in keep]
+    conn.executemany("DELETE FROM cache WHERE rowid=?", dropped)
+    renamed = [(keep[rowid], rowid) for rowid, key, _, _ in rows if rowid in keep and key != keep[rowid]]
+    conn.executemany("UPDATE cache SET content_key=? WHERE rowid=?", renamed)
+    logging.info(f"[DB] canon keys: {len(renamed)} renamed, {len(dropped)} duplicates dropped")
+
+
+def _m2_url_alias(conn: sqlite3.Connection):
+    """Таблица нормализованный URL → content_key; засеваем её source_url уже закэшированных строк."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS url_alias (
+            url TEXT PRIMARY KEY,
+            content_key TEXT NOT NULL,
+            seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    rows = conn.execute(
+        "SELECT source_url, content_key FROM cache WHERE source_url IS NOT NULL AND source_url != '' "
+        "ORDER BY created_at"
+    ).fetchall()
+    conn.executemany(
+        "INSERT OR REPLACE INTO url_alias(url, content_key) VALUES (?, ?)",
+        [(normalize_url(u), k) for u, k in rows],
+    )
+    logging.info(f"[DB] url_alias seeded with {len(rows)} urls")
+
+
+def _m3_fts(conn: sqlite3.Connection):
+    """Колонка artist и полнотекстовый индекс по title/artist/source_url."""
+    conn.execute("ALTER TABLE cache ADD COLUMN artist TEXT")
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS cache_fts USING fts5(
+            title, artist, source_url,
+            content='cache', content_rowid='rowid',
+            tokenize='unicode61 remove_diacritics 2'
+        );
+        """
+    )
+    conn.execute("INSERT INTO cache_fts(cache_fts) VALUES ('rebuild')")
+
+
+def _m4_tasks(conn: sqlite3.Connection):
+    """Реестр инлайн-задач (services/task_store) — раньше создавался там своим соединением."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            task_id TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        );
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS tasks_expires ON tasks(expires_at)")
+
+
+_MIGRATIONS = [
+    (1, "canonical content keys", _m1_canon_keys),
+    (2, "url alias table", _m2_url_alias),
+    (3, "full-text search", _m3_fts),
+    (4, "task registry", _m4_tasks),
+]
+
+
+def _migrate(conn: sqlite3.Connection):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );
+        """
+    )
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    for version, name, fn in _MIGRATIONS:
+        if version <= current:
+            continue
+        with conn:
+            fn(conn)
+            conn.execute("INSERT INTO schema_version(version, name) VALUES (?, ?)", (version, name))
+        logging.info(f"[DB] migration {version} ({name}) applied")
 
 
 def db_init():
-    global _conn
-    _conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    _conn.row_factory = sqlite3.Row
-    cur = _conn.cursor()
-    cur.execute(
+    global _readers, _writer
+    conn = _connect()
+    conn.execute(
         """
         CREATE TABLE IF NOT EXISTS cache (
             content_key TEXT NOT NULL,
@@ -31,25 +241,172 @@ def db_init():
         );
         """
     )
-    _conn.commit()
-    logging.info(f"[DB] cache at {DB_PATH}")
+    conn.commit()
+    _migrate(conn)
+    conn.close()
+    if _readers is None:
+        _readers = ThreadPoolExecutor(max_workers=DB_READERS, thread_name_prefix="cache-db-read")
+    if _writer is None:
+        _writer = _Writer()
+        _writer.start()
+    logging.info(f"[DB] cache at {DB_PATH} (WAL, {DB_READERS} readers)")
+
+
+async def db_close():
+    """Дописывает очередь записей и закрывает потоки."""
+    global _readers, _writer
+    if _writer is not None:
+        _writer.jobs.put(None)
+        await asyncio.to_thread(_writer.join)
+        _writer = None
+    if _readers is not None:
+        _readers.shutdown(wait=False)
+        _readers = None
+
+
+def _fetch(sql: str, params: Sequence[Any], one: bool):
+    cur = _reader_conn().execute(sql, params)
+    STATS["reads"] += 1
+    return cur.fetchone() if one else cur.fetchall()
+
+
+async def db_fetchone(sql: str, params: Sequence[Any] = ()) -> Optional[sqlite3.Row]:
+    return await asyncio.get_running_loop().run_in_executor(_readers, _fetch, sql, params, True)
+
+
+async def db_fetchall(sql: str, params: Sequence[Any] = ()) -> List[sqlite3.Row]:
+    return await asyncio.get_running_loop().run_in_executor(_readers, _fetch, sql, params, False)
+
+
+async def db_execute(sql: str, params: Sequence[Any] = ()) -> int:
+    """Запись через поток-писатель; возвращает rowcount после коммита пачки."""
+    return await db_transaction([(sql, params)])
+
+
+async def db_transaction(stmts: List[_Stmt]) -> int:
+    """Несколько операторов одной транзакцией (в общей пачке писателя); rowcount последнего."""
+    return await asyncio.wrap_future(_writer.submit(stmts))
+
+
+def _hot_put(key: Tuple[str, str], row: Optional[sqlite3.Row]):
+    _hot[key] = (None if row is not None else time.monotonic() + CACHE_NEG_TTL, row)
+    _hot.move_to_end(key)
+    while len(_hot) > CACHE_HOT_SIZE:
+        _hot.popitem(last=False)
+
+
+def cache_invalidate(content_key: str, variant_key: Optional[str] = None):
+    """Выкидывает из горячего кэша одну пару или все варианты ключа."""
+    global _generation
+    _generation += 1
+    content_key = canon_key(content_key)
+    if variant_key is not None:
+        _hot.pop((content_key, variant_key), None)
+        return
+    for key in [k for k in _hot if k[0] == content_key]:
+        del _hot[key]
+
+
+async def cache_get(content_key: str, variant_key: str) -> Optional[sqlite3.Row]:
+    # ключи в базе канонические (миграция 1 + cache_put) → ровно один запрос по PK
+    key = (canon_key(content_key), variant_key)
+    item = _hot.get(key)
+    if item is not None:
+        expires_at, row = item
+        if expires_at is None or expires_at > time.monotonic():
+            _hot.move_to_end(key)
+            HOT_STATS["hit" if row is not None else "neg_hit"] += 1
+            return row
+        del _hot[key]
+
+    if _lookups.running(key):
+        HOT_STATS["joined"] += 1
+        return await _lookups.run(key, None)
+
+    async def lookup():
+        gen = _generation
+        row = await db_fetchone(_SQL_GET, key)
+        if gen == _generation:
+            _hot_put(key, row)
+        return row
 
-def cache_get(content_key: str, variant_key: str):
-    cur = _conn.cursor()
-    cur.execute("SELECT * FROM cache WHERE content_key=? AND variant_key=?", (content_key, variant_key))
-    return cur.fetchone()
+    HOT_STATS["miss"] += 1
+    return await _lookups.run(key, lookup)
 
-def cache_put(content_key: str, variant_key: str, *, kind: str, file_id: str, file_unique_id: Optional[str],
+
+async def cache_variants(content_key: str) -> List[sqlite3.Row]:
+    """Все закэшированные варианты одного ключа (префикс PK — один индексный запрос)."""
+    content_key = canon_key(content_key)
+    rows = await db_fetchall("SELECT * FROM cache WHERE content_key=? ORDER BY created_at DESC", (content_key,))
+    for row in rows:
+        _hot_put((content_key, row["variant_key"]), row)
+    return rows
+
+
+async def cache_warm(limit: int = CACHE_WARM_ROWS) -> int:
+    """Греет горячий кэш свежими строками (после рестарта первые нажатия — без диска)."""
+    rows = await db_fetchall("SELECT * FROM cache ORDER BY created_at DESC LIMIT ?", (limit,))
+    for row in reversed(rows):
+        _hot_put((row["content_key"], row["variant_key"]), row)
+    logging.info(f"[DB] warmed {len(rows)} hot rows")
+    return len(rows)
+
+
+async def cache_put(content_key: str, variant_key: str, *, kind: str, file_id: str, file_unique_id: Optional[str],
         width: Optional[int], height: Optional[int], duration: Optional[int], size: Optional[int],
-        fmt_used: str, title: Optional[str], source_url: str):
-    cur = _conn.cursor()
-    cur.execute(
-        """
-        INSERT OR REPLACE INTO cache(content_key, variant_key, kind, file_id, file_unique_id,
-            width, height, duration, size, fmt_used, title, source_url)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (content_key, variant_key, kind, file_id, file_unique_id, width, height, duration, size, fmt_used, title, source_url),
-    )
-    _conn.commit()
-    logging.info(f"[DB] saved {content_key} [{variant_key}] → {file_id}")
\ No newline at end of file
+        fmt_used: str, title: Optional[str], source_url: str, artist: Optional[str] = None):
+    content_key = canon_key(content_key)
+    pk = (content_key, variant_key)
+    await db_transaction([
+        (_SQL_FTS_DEL, pk),
+        (_SQL_PUT, (content_key, variant_key, kind, file_id, file_unique_id, width, height, duration, size,
+                    fmt_used, title, artist, source_url)),
+        (_SQL_FTS_ADD, pk),
+    ])
+    cache_invalidate(content_key, variant_key)
+    logging.info(f"[DB] saved {content_key} [{variant_key}] → {file_id}")
+
+
+# ── поиск ────────────────────────────────────────────────
+def _fts_query(text: str) -> str:
+    # каждое слово — префиксный терм в кавычках (спецсимволы FTS5 не ломают запрос), все через AND
+    words = [w.replace('"', '""') for w in text.split()]
+    return " ".join(f'"{w}"*' for w in words if w)
+
+
+async def cache_search(text: str, limit: int = 20) -> List[sqlite3.Row]:
+    """Закэшированные файлы по словам из названия/исполнителя/ссылки, лучшие совпадения первыми."""
+    query = _fts_query(text)
+    if not query:
+        return []
+    return await db_fetchall(_SQL_SEARCH, (query, limit))
+
+
+# ── алиасы ссылок ────────────────────────────────────────
+_SQL_ALIAS_GET = "SELECT content_key FROM url_alias WHERE url=?"
+_SQL_ALIAS_PUT = "INSERT OR REPLACE INTO url_alias(url, content_key, seen_at) VALUES (?, ?, CURRENT_TIMESTAMP)"
+
+
+async def alias_get(url: str) -> Optional[str]:
+    """content_key, под которым эта ссылка уже разрешалась, — без yt-dlp; None, если не видели."""
+    row = await db_fetchone(_SQL_ALIAS_GET, (normalize_url(url),))
+    return row[0] if row else None
+
+
+def alias_put(url: str, content_key: str):
+    """Запоминает ссылку → ключ. Не ждёт записи; можно звать из любого потока."""
+    if _writer is None or not url or not content_key:
+        return
+    _writer.submit([(_SQL_ALIAS_PUT, (normalize_url(url), canon_key(content_key)))])
+
+
+def db_stats():
+    pending = _writer.jobs.qsize() if _writer is not None else 0
+    return dict(STATS, write_queue=pending)
+
+
+def hot_stats() -> Dict[str, Any]:
+    st = HOT_STATS
+    total = st["hit"] + st["neg_hit"] + st["miss"] + st["joined"]
+    hit_rate = (st["hit"] + st["neg_hit"] + st["joined"]) / total if total else 0.0
+    return dict(st, size=len(_hot), hit_rate=hit_rate)
@@ -1,25 +1,25 @@
 #services/content_key.py
 import json, subprocess, logging, hashlib
 from typing import Dict, Any, Optional, Tuple
-from services.ytdlp import ytdlp_info
+from services.meta_cache import get_info
 from utils.text import normalize_youtube_url
 from utils.youtube import extract_youtube_id
+from utils.url_keys import offline_content_key
+from services.cache_db import alias_put
 
 def _canon_extractor(name: str) -> str:
     # всегда нижний регистр, чтобы ключ был "youtube:<id>"
     return (name or "unknown").lower()
 
-def canon_key(key: str) -> str:
-    # "YouTube:abc" -> "youtube:abc"
-    if not key or ":" not in key:
-        return key
-    extractor, rest = key.split(":", 1)
-    return f"{_canon_extractor(extractor)}:{rest}"
+def _remember_alias(url: str, key: str):
+    # ссылки, ключ которых виден и так, в алиасы не пишем
+    if offline_content_key(url) != key:
+        alias_put(url, key)
 
 def get_content_key_and_title(url: str):
     url = normalize_youtube_url(url)
     try:
-        info = ytdlp_info(url)  # ✅ берём JSON через services/ytdlp (с куками)
+        info = get_info(url)  # ✅ JSON из общего кэша метаданных (yt-dlp только при промахе)
         extractor = (info.get("extractor_key")
                      or info.get("extractor")
                      or "unknown")
@@ -32,17 +32,22 @@ def get_content_key_and_title(url: str):
             vid = extract_youtube_id(url)
 
         if vid:
-            return f"{extractor}:{vid}", title
+            key = f"{extractor}:{vid}"
+            _remember_alias(url, key)
+            return key, title
     except Exception as e:
         logging.warning(f"[CKEY] ytdlp_info failed: {e}")
 
-    # fallback: пробуем вытащить ID сами
-    yid = extract_youtube_id(url)
-    if yid:
-        return "youtube:" + yid, None
+    return _fallback_key(url), None
+
+def _fallback_key(url: str) -> str:
+    # fallback: пробуем вытащить ID сами (офлайн-парсеры по хосту)
+    key = offline_content_key(url)
+    if key:
+        return key
 
     # если вообще ничего не получилось → хэш URL
-    return "urlsha1:" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:16], None
+    return "urlsha1:" + hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
 
 def detect_media_kind_and_key(url: str):
     """
@@ -50,7 +55,7 @@ def detect_media_kind_and_key(url: str):
     mode: 'video' | 'audio' | 'unknown'
     """
     try:
-        info = ytdlp_info(url)
+        info = get_info(url)
         fmts = info.get("formats", []) or []
         has_video = any(f.get("vcodec") not in (None, "none") for f in fmts)
         has_audio_only = any((f.get("vcodec") in (None, "none")) and (f.get("acodec") not in (None, "none")) for f in fmts)
@@ -60,15 +65,17 @@ def detect_media_kind_and_key(url: str):
         title = info.get("title")
 
         key = f"{extractor}:{vid}" if vid else f"{extractor}:{hash(url)}"
+        if vid:
+            _remember_alias(url, key)
         mode = "video" if has_video else ("audio" if has_audio_only else "unknown")
         return mode, key, title
     except Exception:
-        key, title = get_content_key_and_title(url)
-        return "unknown", key, title
+        # get_content_key_and_title здесь снова дёрнул бы yt-dlp (ошибки не кэшируются)
+        return "unknown", _fallback_key(normalize_youtube_url(url)), None
 
 def extract_title_artist(url: str, fallback_title: Optional[str] = None) -> Tuple[str, str]:
     try:
-        info = ytdlp_info(url)
+        info = get_info(url)
         title_full = info.get("track") or info.get("title") or fallback_title or "Audio"
         artist = info.get("artist") or info.get("uploader") or ""
         return title_full, artist
@@ -77,7 +84,7 @@ def extract_title_artist(url: str, fallback_title: Optional[str] = None) -> Tupl
 
 def probe_formats(url: str) -> Dict[str, Any]:
     try:
-        info = ytdlp_info(url)
+        info = get_info(url)
         fmts = info.get("formats", []) or []
         def human_size(x):
             s = x or 0
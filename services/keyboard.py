@@ -1,26 +1,32 @@
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from services.content_key import probe_formats
+from utils.callback_data import encode_callback
 
-def build_full_format_keyboard(task_id: str, url: str) -> InlineKeyboardMarkup:
+def build_full_format_keyboard(task_id: str, url: str, content_key: str = None) -> InlineKeyboardMarkup:
     data = probe_formats(url)
+
+    def cb(action: str, fmt: str = None) -> str:
+        return encode_callback(action, task_id, content_key, fmt)
+
     btns = []
     if data["progressive"]:
         for f in data["progressive"]:
-            btns.append([InlineKeyboardButton(f"▶️ {f['label']}", callback_data=f"fmt|{task_id}|{f['fmt']}")])
+            btns.append([InlineKeyboardButton(f"▶️ {f['label']}", callback_data=cb("fmt", f['fmt']))])
     if data["merged"]:
-        btns.append([InlineKeyboardButton("— склеенные варианты —", callback_data=f"noop|{task_id}")])
+        btns.append([InlineKeyboardButton("— склеенные варианты —", callback_data=cb("noop"))])
         for f in data["merged"]:
-            btns.append([InlineKeyboardButton(f"🧩 {f['label']}", callback_data=f"fmt|{task_id}|{f['fmt']}")])
+            btns.append([InlineKeyboardButton(f"🧩 {f['label']}", callback_data=cb("fmt", f['fmt']))])
     if data["video_only"]:
-        btns.append([InlineKeyboardButton("— видео без звука —", callback_data=f"noop|{task_id}")])
+        btns.append([InlineKeyboardButton("— видео без звука —", callback_data=cb("noop"))])
         for f in data["video_only"]:
-            btns.append([InlineKeyboardButton(f"🔇 {f['label']}", callback_data=f"fmt|{task_id}|{f['fmt']}")])
-    btns.append([InlineKeyboardButton("— аудио —", callback_data=f"noop|{task_id}")])
-    btns.append([InlineKeyboardButton("🎵 Audio (mp3)", callback_data=f"aud|{task_id}|mp3")])
-    btns.append([InlineKeyboardButton("🎵 Audio (m4a)", callback_data=f"aud|{task_id}|m4a")])
+            btns.append([InlineKeyboardButton(f"🔇 {f['label']}", callback_data=cb("fmt", f['fmt']))])
+    btns.append([InlineKeyboardButton("— аудио —", callback_data=cb("noop"))])
+    btns.append([InlineKeyboardButton("🎵 Audio (mp3)", callback_data=cb("aud", "mp3"))])
+    btns.append([InlineKeyboardButton("🎵 Audio (m4a)", callback_data=cb("aud", "m4a"))])
     for f in data["audio_only"][:5]:
-        btns.append([InlineKeyboardButton(f"🎵 {f['label']}", callback_data=f"audfmt|{task_id}|{f['fmt']}")])
-    btns.append([InlineKeyboardButton("GIF (оптим., ≤50MB)", callback_data=f"gif|{task_id}")])
+        btns.append([InlineKeyboardButton(f"🎵 {f['label']}", callback_data=cb("audfmt", f['fmt']))])
+    btns.append([InlineKeyboardButton("GIF (оптим., ≤50MB)", callback_data=cb("gif"))])
+    btns.append([InlineKeyboardButton("GIF-файл (.gif)", callback_data=cb("giffile"))])
     if len(btns) == 1:
-        btns.insert(0, [InlineKeyboardButton("best (автовыбор)", callback_data=f"fmt|{task_id}|bv*+ba/b")])
+        btns.insert(0, [InlineKeyboardButton("best (автовыбор)", callback_data=cb("fmt", "bv*+ba/b"))])
     return InlineKeyboardMarkup(btns)
\ No newline at end of file
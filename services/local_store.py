@@ -0,0 +1,148 @@
+# services/local_store.py
+# Локальное хранилище свежескачанных исходников: content_key → файл на диске на LOCAL_STORE_TTL.
+# Производные варианты (аудио, GIF) режутся из него ffmpeg'ом, а не качаются с сайта повторно.
+# Функции синхронные (диск): из event loop — через asyncio.to_thread.
+import asyncio, hashlib, logging, os, threading, time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import SAVE_DIR, LOCAL_STORE_TTL, LOCAL_STORE_MAX_MB, LOCAL_STORE_SWEEP_INTERVAL
+from utils.url_keys import canon_key
+
+STORE_DIR = os.path.join(SAVE_DIR, "store")
+
+_lock = threading.Lock()
+_leases: Dict[str, int] = {}  # путь -> сколько задач сейчас читают файл (sweep их не трогает)
+_sweeper: Optional[asyncio.Task] = None
+
+
+def _stem(content_key: str) -> str:
+    return hashlib.sha1(canon_key(content_key).encode("utf-8")).hexdigest()[:20]
+
+
+def _files(stem: Optional[str] = None) -> List[Tuple[str, os.stat_result]]:
+    try:
+        names = os.listdir(STORE_DIR)
+    except FileNotFoundError:
+        return []
+    out = []
+    for name in names:
+        if stem and not name.startswith(stem + "."):
+            continue
+        path = os.path.join(STORE_DIR, name)
+        try:
+            out.append((path, os.stat(path)))
+        except FileNotFoundError:
+            pass
+    return out
+
+
+def _find_locked(content_key: str) -> Optional[str]:
+    now = time.time()
+    fresh = [(st.st_mtime, p) for p, st in _files(_stem(content_key)) if now - st.st_mtime < LOCAL_STORE_TTL]
+    return max(fresh)[1] if fresh else None
+
+
+def _drop_locked(path: str):
+    if _leases.get(path):
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def sweep():
+    """Удаляет просроченное и, если хранилище больше лимита, самое старое."""
+    with _lock:
+        now = time.time()
+        files = sorted(_files(), key=lambda x: x[1].st_mtime)
+        total = 0
+        alive = []
+        for path, st in files:
+            if now - st.st_mtime >= LOCAL_STORE_TTL:
+                _drop_locked(path)
+            else:
+                alive.append((path, st.st_size))
+                total += st.st_size
+        limit = LOCAL_STORE_MAX_MB * 1024 * 1024
+        for path, size in alive:
+            if total <= limit:
+                break
+            if not _leases.get(path):
+                _drop_locked(path)
+                total -= size
+
+
+def keep(content_key: str, path: str) -> Optional[str]:
+    """
+    Забирает скачанный файл в хранилище (вместо удаления) и возвращает новый путь.
+    None — не вышло; файл остаётся на месте, его удаляет вызывающий.
+    """
+    if not path or not os.path.exists(path):
+        return None
+    stem = _stem(content_key)
+    dst = os.path.join(STORE_DIR, stem + os.path.splitext(path)[1].lower())
+    try:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        with _lock:
+            if _leases.get(dst):
+                return None  # этот же файл сейчас читают — не подменяем
+            for old, _ in _files(stem):
+                if old != dst:
+                    _drop_locked(old)
+            os.replace(path, dst)
+            os.utime(dst)  # TTL считаем от загрузки, а не от mtime, выставленного yt-dlp
+    except OSError as e:
+        logging.warning(f"[STORE] keep {content_key} failed: {e}")
+        return None
+    logging.info(f"[STORE] {content_key} → {dst}")
+    sweep()
+    return dst
+
+
+@contextmanager
+def lease(content_key: str) -> Iterator[Optional[str]]:
+    """with lease(key) as path: — свежий исходник (или None), который не удалят, пока он нужен."""
+    with _lock:
+        path = _find_locked(content_key)
+        if path:
+            _leases[path] = _leases.get(path, 0) + 1
+    try:
+        yield path
+    finally:
+        if path:
+            with _lock:
+                left = _leases.get(path, 1) - 1
+                if left:
+                    _leases[path] = left
+                else:
+                    _leases.pop(path, None)
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(LOCAL_STORE_SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception as e:
+            logging.warning(f"[STORE] sweep failed: {e}")
+
+
+async def start():
+    """Уборка при старте и по таймеру: TTL и лимит соблюдаются и без новых загрузок."""
+    global _sweeper
+    await asyncio.to_thread(sweep)
+    if _sweeper is None:
+        _sweeper = asyncio.create_task(_sweep_loop())
+
+
+async def stop():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        _sweeper = None
+
+
+def store_stats() -> Dict[str, int]:
+    files = _files()
+    return {"files": len(files), "bytes": sum(st.st_size for _, st in files), "leased": len(_leases)}
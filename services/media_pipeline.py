@@ -0,0 +1,132 @@
+# services/media_pipeline.py
+# Общий конвейер «ключ → file_id» для инлайн-кнопок и личных сообщений:
+# cache.db → уже идущая задача на тот же ключ → своя задача (produce),
+# которая заливает файл в кэш-чат и записывает file_id в cache.db.
+import asyncio, logging, os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Optional, Set
+from telegram import InputFile
+from config import CACHE_CHAT_ID, CACHE_THREAD_ID, MAX_TG_SIZE, SAVE_DIR, TG_DOWNLOAD_MAX
+from services import local_store
+from services.cache_db import cache_get, cache_put
+from services.pyro_send import send_via_userbot
+from services.scheduler import scheduler, UPLOAD
+from services.singleflight import INFLIGHT, MediaResult
+from services.video import get_video_info, generate_thumbnail
+from utils.url_keys import canon_key
+
+
+_notices: Set[asyncio.Task] = set()  # фоновые on_join (ссылка, чтобы задачу не собрал GC)
+
+
+async def _notify(on_join: Callable[[], Awaitable]):
+    try:
+        await on_join()
+    except Exception as e:
+        logging.warning(f"[INFLIGHT] on_join failed: {e}")
+
+
+async def obtain(content_key: str, variant: str, produce: Callable[[], Awaitable[MediaResult]],
+                 on_join: Optional[Callable[[], Awaitable]] = None) -> MediaResult:
+    """Кэш → уже идущая задача на этот ключ → своя задача (produce)."""
+    row = await cache_get(content_key, variant)
+    if row:
+        logging.info(f"[CACHE HIT] {content_key} [{variant}] → {row['file_id']}")
+        return MediaResult.from_row(row)
+    key = (canon_key(content_key), variant)
+    if INFLIGHT.running(key):
+        # кто-то уже качает это же — ждём его результат, а не качаем второй раз
+        logging.info(f"[INFLIGHT] join {key}")
+        if on_join:
+            # подпись — фоном: пока она уходит, чужая задача может закончиться,
+            # и тогда INFLIGHT.run ниже запустил бы вторую загрузку
+            task = asyncio.create_task(_notify(on_join))
+            _notices.add(task)
+            task.add_done_callback(_notices.discard)
+
+    async def checked() -> MediaResult:
+        # повторная проверка уже под single-flight: между cache_get выше и этим местом
+        # предыдущая задача на ключ могла закончиться и записать file_id
+        row = await cache_get(content_key, variant)
+        if row:
+            logging.info(f"[CACHE HIT/RECHECK] {content_key} [{variant}] → {row['file_id']}")
+            return MediaResult.from_row(row)
+        return await produce()
+
+    return await INFLIGHT.run(key, checked)
+
+
+async def upload_video(bot, video_path: str, content_key: str, variant: str, *,
+                       title: Optional[str], fmt_used: str, url: str,
+                       user_id: Optional[int] = None, cost: float = 600.0) -> MediaResult:
+    """Заливает видео в кэш-чат (>50MB — юзерботом) и сохраняет file_id в cache.db."""
+    size = os.path.getsize(video_path)
+    thumb = None
+    try:
+        if size <= MAX_TG_SIZE:
+            duration, width, height = await get_video_info(video_path)
+            thumb = await generate_thumbnail(video_path)
+            async with scheduler.slot(UPLOAD, user_id=user_id, cost=cost, label="upload"):
+                with open(video_path, "rb") as f:
+                    sent = await bot.send_video(
+                        chat_id=CACHE_CHAT_ID, message_thread_id=CACHE_THREAD_ID,
+                        video=f,
+                        duration=duration, width=width, height=height,
+                        thumbnail=InputFile(thumb) if thumb else None,
+                        caption="Кэширование…",
+                    )
+            file_id = sent.video.file_id
+            file_unique_id = sent.video.file_unique_id
+        else:
+            async with scheduler.slot(UPLOAD, user_id=user_id, cost=cost, label="userbot"):
+                file_id, duration, width, height = await send_via_userbot(
+                    video_path, caption=f"Кэширование… {url}", bot=bot
+                )
+            file_unique_id = None
+    finally:
+        if thumb and os.path.exists(thumb):
+            try:
+                os.remove(thumb)
+            except OSError:
+                pass
+
+    await cache_put(
+        content_key, variant, kind="video",
+        file_id=file_id, file_unique_id=file_unique_id,
+        width=width, height=height, duration=duration, size=size,
+        fmt_used=fmt_used, title=title, source_url=url
+    )
+    return MediaResult("video", file_id, width, height, duration)
+
+
+# вариант-исходник, из которого режутся производные
+SOURCE_VARIANT = "video:smart1080"
+
+
+@asynccontextmanager
+async def source_for(bot, content_key: str) -> AsyncIterator[Optional[str]]:
+    """
+    async with source_for(bot, key) as path: — локальный исходник для производных вариантов.
+    Сначала local_store; если там нет, но видео уже лежит в Telegram и влезает в getFile, —
+    тянем его оттуда (быстрее сайта). None — придётся качать с источника.
+    """
+    with local_store.lease(content_key) as path:
+        if path:
+            yield path
+            return
+
+    row = await cache_get(content_key, SOURCE_VARIANT)
+    if row and row["size"] and row["size"] <= TG_DOWNLOAD_MAX:
+        tmp = os.path.join(SAVE_DIR, f"tg_{row['file_id'][-16:]}.mp4")
+        try:
+            tg_file = await bot.get_file(row["file_id"])
+            await tg_file.download_to_drive(tmp)
+            if not await asyncio.to_thread(local_store.keep, content_key, tmp):
+                os.remove(tmp)
+        except Exception as e:
+            logging.warning(f"[STORE] telegram source for {content_key} failed: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    with local_store.lease(content_key) as path:
+        yield path
@@ -0,0 +1,187 @@
+# services/meta_cache.py
+# Общий кэш метаданных yt-dlp: LRU в памяти + SQLite (meta.db) с TTL по экстрактору.
+import json, sqlite3, threading, time, zlib, logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from config import META_DB_PATH, META_LRU_SIZE, META_TTL, META_TTL_DEFAULT
+from services.ytdlp import ytdlp_info
+from utils.url_keys import normalize_url
+
+_lru: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+_lru_lock = threading.Lock()
+
+# одна экстракция на URL, даже если его одновременно запросили несколько потоков
+_url_locks: Dict[str, list] = {}  # url -> [lock, число ожидающих]
+_url_locks_guard = threading.Lock()
+
+_conn: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+
+STATS = {"lru_hit": 0, "db_hit": 0, "miss": 0, "error": 0}
+
+
+def _db() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(META_DB_PATH, check_same_thread=False)
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                url TEXT PRIMARY KEY,
+                extractor TEXT,
+                info BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            """
+        )
+        _conn.execute("DELETE FROM meta WHERE expires_at < ?", (time.time(),))
+        _conn.commit()
+        logging.info(f"[META] cache at {META_DB_PATH}")
+    return _conn
+
+
+def _ttl_for(info: Dict[str, Any]) -> int:
+    extractor = (info.get("extractor_key") or info.get("extractor") or "").lower()
+    # "youtube:tab" и подобные → "youtube"
+    return META_TTL.get(extractor.split(":", 1)[0], META_TTL_DEFAULT)
+
+
+def _lru_get(key: str) -> Optional[Dict[str, Any]]:
+    with _lru_lock:
+        item = _lru.get(key)
+        if not item:
+            return None
+        expires_at, info = item
+        if expires_at < time.time():
+            del _lru[key]
+            return None
+        _lru.move_to_end(key)
+        return info
+
+
+def _lru_put(key: str, info: Dict[str, Any], expires_at: float):
+    with _lru_lock:
+        _lru[key] = (expires_at, info)
+        _lru.move_to_end(key)
+        while len(_lru) > META_LRU_SIZE:
+            _lru.popitem(last=False)
+
+
+def _db_get(key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    with _db_lock:
+        row = _db().execute("SELECT info, expires_at FROM meta WHERE url=?", (key,)).fetchone()
+    if not row or row[1] < time.time():
+        return None
+    try:
+        return row[1], json.loads(zlib.decompress(row[0]))
+    except Exception as e:
+        logging.warning(f"[META] broken row for {key}: {e}")
+        return None
+
+
+def _db_put(key: str, info: Dict[str, Any], expires_at: float):
+    blob = zlib.compress(json.dumps(info, ensure_ascii=False).encode("utf-8"))
+    extractor = (info.get("extractor_key") or info.get("extractor") or "").lower()
+    with _db_lock:
+        conn = _db()
+        conn.execute(
+            "INSERT OR REPLACE INTO meta(url, extractor, info, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, extractor, blob, time.time(), expires_at),
+        )
+        conn.commit()
+
+
+def _acquire_url(key: str) -> list:
+    with _url_locks_guard:
+        entry = _url_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    entry[0].acquire()
+    return entry
+
+
+def _release_url(key: str, entry: list):
+    entry[0].release()
+    with _url_locks_guard:
+        entry[1] -= 1
+        if entry[1] == 0:
+            _url_locks.pop(key, None)
+
+
+def get_info(url: str) -> Dict[str, Any]:
+    """
+    Read-through обёртка над ytdlp_info: LRU → SQLite → yt-dlp.
+    Ошибки yt-dlp пробрасываются и не кэшируются.
+    """
+    key = normalize_url(url)
+    info = _lru_get(key)
+    if info is not None:
+        STATS["lru_hit"] += 1
+        return info
+
+    entry = _acquire_url(key)
+    try:
+        # пока ждали лок, соседний поток мог уже всё получить
+        info = _lru_get(key)
+        if info is not None:
+            STATS["lru_hit"] += 1
+            return info
+
+        hit = _db_get(key)
+        if hit:
+            STATS["db_hit"] += 1
+            expires_at, info = hit
+            _lru_put(key, info, expires_at)
+            return info
+
+        STATS["miss"] += 1
+        try:
+            info = ytdlp_info(key)
+        except Exception:
+            STATS["error"] += 1
+            raise
+        expires_at = time.time() + _ttl_for(info)
+        _lru_put(key, info, expires_at)
+        try:
+            _db_put(key, info, expires_at)
+        except Exception as e:
+            logging.warning(f"[META] db write failed for {key}: {e}")
+        logging.info(f"[META] miss {key} → cached for {int(expires_at - time.time())}s")
+        return info
+    finally:
+        _release_url(key, entry)
+
+
+def peek_info(url: str, memory_only: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Info из кэша без похода в yt-dlp; None при промахе.
+    memory_only — только LRU: дёшево звать прямо из event loop (SQLite+zlib — уже через run_io).
+    """
+    key = normalize_url(url)
+    info = _lru_get(key)
+    if info is not None or memory_only:
+        return info
+    hit = _db_get(key)
+    if not hit:
+        return None
+    expires_at, info = hit
+    _lru_put(key, info, expires_at)
+    return info
+
+
+def invalidate(url: str):
+    key = normalize_url(url)
+    with _lru_lock:
+        _lru.pop(key, None)
+    with _db_lock:
+        conn = _db()
+        conn.execute("DELETE FROM meta WHERE url=?", (key,))
+        conn.commit()
+
+
+def meta_stats() -> Dict[str, Any]:
+    total = sum(STATS[k] for k in ("lru_hit", "db_hit", "miss"))
+    hits = STATS["lru_hit"] + STATS["db_hit"]
+    with _lru_lock:
+        size = len(_lru)
+    return dict(STATS, lru_size=size, hit_rate=(hits / total if total else 0.0))
@@ -0,0 +1,118 @@
+# services/prefetch.py
+# Спекулятивная предвыборка метаданных на inline_query: пока юзер смотрит на мини-клавиатуру,
+# content_key/mode/title уже резолвятся в фоне (info заодно оседает в meta_cache).
+import asyncio, logging, time
+from typing import Dict, Optional, NamedTuple, Set, Tuple
+from config import PREFETCH_ENABLED, PREFETCH_MAX_PARALLEL, PREFETCH_MAX_PENDING, PREFETCH_TTL
+from services.content_key import detect_media_kind_and_key, get_content_key_and_title
+from utils.text import normalize_youtube_url
+from utils.url_keys import strip_tracking
+from utils.threading import run_io
+
+
+class Prefetched(NamedTuple):
+    mode: str                # 'video' | 'audio' | 'unknown' (для "auto")
+    auto_key: str            # ключ detect_media_kind_and_key (ветка "auto")
+    content_key: str         # ключ get_content_key_and_title (остальные ветки)
+    title: Optional[str]
+
+
+_sem = asyncio.Semaphore(PREFETCH_MAX_PARALLEL)
+
+_probes: Dict[str, asyncio.Task] = {}          # url -> задача (одна на URL для всех юзеров)
+_started: Set[str] = set()                     # url, чьи задачи уже дёргают yt-dlp
+_refs: Dict[str, Set[str]] = {}                # url -> task_id, которые её ждут
+_tasks: Dict[str, Tuple[float, str]] = {}      # task_id -> (created_at, url)
+_last_by_user: Dict[int, str] = {}             # user_id -> последний task_id
+
+
+def _resolve(url: str) -> Prefetched:
+    mode, auto_key, title = detect_media_kind_and_key(url)
+    # info уже в LRU meta_cache → второй вызов без yt-dlp
+    content_key, title2 = get_content_key_and_title(url)
+    return Prefetched(mode, auto_key, content_key, title or title2)
+
+
+async def _probe(url: str) -> Prefetched:
+    async with _sem:
+        _started.add(url)
+        try:
+            res = await run_io(_resolve, url)
+            logging.info(f"[PREFETCH] {url} → {res.mode} {res.content_key}")
+            return res
+        finally:
+            _started.discard(url)
+
+
+def _drop(task_id: str):
+    item = _tasks.pop(task_id, None)
+    if not item:
+        return
+    url = item[1]
+    refs = _refs.get(url)
+    if refs is not None:
+        refs.discard(task_id)
+        if not refs:
+            _refs.pop(url, None)
+            t = _probes.pop(url, None)
+            # ещё не начали — отменяем; уже в yt-dlp — пусть доедет в meta_cache
+            if t and not t.done() and url not in _started:
+                t.cancel()
+
+
+def _sweep():
+    deadline = time.time() - PREFETCH_TTL
+    for task_id in [t for t, (ts, _) in _tasks.items() if ts < deadline]:
+        _drop(task_id)
+    for user_id in [u for u, t in _last_by_user.items() if t not in _tasks]:
+        del _last_by_user[user_id]
+
+
+def schedule_prefetch(task_id: str, url: str, user_id: Optional[int] = None):
+    """Запускает фоновый probe для task_id. Повторный URL переиспользует уже идущий probe."""
+    if not PREFETCH_ENABLED:
+        return
+    _sweep()
+
+    # юзер допечатал ссылку — прошлый task больше не нужен
+    if user_id is not None:
+        prev = _last_by_user.get(user_id)
+        if prev and prev != task_id:
+            _drop(prev)
+        _last_by_user[user_id] = task_id
+
+    key = normalize_youtube_url(strip_tracking(url))
+    if key not in _probes:
+        pending = sum(1 for t in _probes.values() if not t.done())
+        if pending >= PREFETCH_MAX_PENDING:
+            logging.info(f"[PREFETCH] skip {key}: {pending} pending")
+            return
+        _probes[key] = asyncio.create_task(_probe(key))
+    _refs.setdefault(key, set()).add(task_id)
+    _tasks[task_id] = (time.time(), key)
+
+
+async def get_prefetched(task_id: str) -> Optional[Prefetched]:
+    """
+    Результат предвыборки для task_id или None.
+    Идущий probe дожидаемся, ещё не начатый — отменяем (вызывающий резолвит сам).
+    """
+    item = _tasks.get(task_id)
+    if not item:
+        return None
+    url = item[1]
+    t = _probes.get(url)
+    if t is None:
+        return None
+    if not t.done() and url not in _started:
+        _drop(task_id)
+        return None
+    try:
+        return await asyncio.shield(t)
+    except asyncio.CancelledError:
+        if not t.cancelled():
+            raise  # отменили нас самих, а не probe
+        return None
+    except Exception as e:
+        logging.warning(f"[PREFETCH] {url} failed: {e}")
+        return None
@@ -0,0 +1,111 @@
+# services/progress.py
+# Живой прогресс скачивания в подписи/статусе с оглядкой на лимиты Telegram:
+# не чаще раза в N секунд на сообщение, общий token bucket на все правки,
+# промежуточные состояния схлопываются, одинаковый текст не отправляется.
+import asyncio, logging
+from typing import Awaitable, Callable, Optional
+from telegram.error import BadRequest, RetryAfter
+from config import PROGRESS_EDIT_INTERVAL, PROGRESS_GLOBAL_RATE
+from services.ytdlp import DlProgress
+from utils.text import format_bytes
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._at: Optional[float] = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._at is not None:
+                    self._tokens = min(self.burst, self._tokens + (now - self._at) * self.rate)
+                self._at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# общий на процесс: все прогресс-правки вместе не выедают лимит бота
+_bucket = TokenBucket(PROGRESS_GLOBAL_RATE, PROGRESS_GLOBAL_RATE)
+
+
+def _fmt_eta(sec: Optional[int]) -> str:
+    if sec is None:
+        return "?"
+    m, s = divmod(int(sec), 60)
+    return f"{m // 60}:{m % 60:02d}:{s:02d}" if m >= 60 else f"{m}:{s:02d}"
+
+
+def render_progress(header: str, p: DlProgress) -> str:
+    parts = []
+    if p.percent is not None:
+        parts.append(f"{p.percent:.0f}%")
+    else:
+        parts.append(format_bytes(p.downloaded))
+    if p.speed:
+        parts.append(f"{format_bytes(int(p.speed))}/с")
+    if p.eta is not None:
+        parts.append(f"осталось {_fmt_eta(p.eta)}")
+    return f"{header}\n" + " · ".join(parts)
+
+
+class ProgressCaption:
+    """
+    on_progress для *_async загрузок: render → (не чаще interval) → edit(text).
+    edit — корутина, меняющая подпись/текст одного сообщения.
+    show(text) — то же для произвольного текста (например, счётчик «готово N/M»).
+    """
+    def __init__(self, edit: Callable[[str], Awaitable], header: str, interval: float = PROGRESS_EDIT_INTERVAL):
+        self._edit = edit
+        self._header = header
+        self._interval = interval
+        self._pending: Optional[str] = None
+        self._last_text: Optional[str] = None
+        self._last_at = float("-inf")
+        self._task: Optional[asyncio.Task] = None
+
+    async def __call__(self, p: DlProgress):
+        await self.show(render_progress(self._header, p))
+
+    async def show(self, text: str):
+        if text == self._last_text:
+            return
+        self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        wait = self._last_at + self._interval - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        await _bucket.acquire()
+        # за время ожидания могли прийти новые состояния — шлём последнее
+        text, self._pending = self._pending, None
+        if text is None or text == self._last_text:
+            return
+        self._last_at = loop.time()
+        try:
+            await self._edit(text)
+            self._last_text = text
+        except RetryAfter as e:
+            self._last_at = loop.time() + e.retry_after
+        except BadRequest as e:
+            if "message is not modified" not in str(e).lower():
+                logging.warning(f"[PROGRESS] edit fail: {e}")
+
+    async def aclose(self):
+        """Гасит отложенную правку, чтобы она не перетёрла итоговое сообщение."""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
@@ -4,15 +4,14 @@ from typing import Optional
 import state  # <-- читаем живые значения
 from config import CACHE_CHAT_ID, CACHE_THREAD_ID
 from services.video import get_video_info, generate_thumbnail
-from utils.threading import run_io  # если у тебя есть обертка
 
 async def send_via_userbot(video_path: str, caption: Optional[str] = None, bot=None):
     if bot is None:
         raise RuntimeError("Нужно передать bot (context.bot).")
     app = await state.get_pyro_app()
 
-    duration, width, height = await run_io(get_video_info, video_path)
-    thumb = await run_io(generate_thumbnail, video_path)
+    duration, width, height = await get_video_info(video_path)
+    thumb = await generate_thumbnail(video_path)
 
     base_kwargs = dict(
         caption=caption or "",
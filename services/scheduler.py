@@ -0,0 +1,103 @@
+# services/scheduler.py
+# Планировщик тяжёлых задач вместо одного FIFO DL_SEM: отдельные пулы
+# (сеть / CPU-транскод / аплоад) и приоритеты — владелец, затем юзер с меньшим
+# числом своих задач, затем более короткая задача, затем порядок прихода.
+import asyncio, heapq, itertools, logging, time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from config import OWNER_ID, SCHED_NET_SLOTS, SCHED_CPU_SLOTS, SCHED_UPLOAD_SLOTS
+
+NET, CPU, UPLOAD = "net", "cpu", "upload"
+
+# во сколько раз аудио «дешевле» видео той же длительности
+_KIND_COST = {"video": 1.0, "anim": 0.5, "audio": 0.1}
+
+
+def estimate_cost(info: Optional[Dict[str, Any]], kind: str = "video") -> float:
+    """Оценка тяжести задачи (условные секунды видео) по -J; без info — середина шкалы."""
+    factor = _KIND_COST.get(kind, 1.0)
+    if not info:
+        return 600.0 * factor
+    size = info.get("filesize") or info.get("filesize_approx")
+    if size:
+        # ~1 МБ/с для 1080p — переводим байты в «секунды»
+        return size / (1024 * 1024) * factor
+    return float(info.get("duration") or 600) * factor
+
+
+class _Pool:
+    def __init__(self, name: str, slots: int):
+        self.name = name
+        self.slots = slots
+        self.running = 0
+        self.heap: List[Tuple[tuple, asyncio.Future]] = []
+        self.per_user: Dict[int, int] = {}   # user_id -> задач (в очереди + в работе)
+        self.waited = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def grant_next(self):
+        while self.heap and self.running < self.slots:
+            _, fut = heapq.heappop(self.heap)
+            if fut.done():  # ожидающий отменился
+                continue
+            self.running += 1
+            fut.set_result(None)
+
+
+class Scheduler:
+    def __init__(self, slots: Dict[str, int]):
+        self._pools = {name: _Pool(name, n) for name, n in slots.items()}
+        self._seq = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, pool: str, *, user_id: Optional[int] = None, cost: float = 600.0, label: str = ""):
+        """async with scheduler.slot(NET, user_id=..., cost=...): — ждём слот по приоритету."""
+        p = self._pools[pool]
+        uid = user_id or 0
+        owner = bool(user_id) and user_id == OWNER_ID
+        prio = (0 if owner else 1, p.per_user.get(uid, 0), cost, next(self._seq))
+        p.per_user[uid] = p.per_user.get(uid, 0) + 1
+        started = time.monotonic()
+        try:
+            fut = asyncio.get_running_loop().create_future()
+            heapq.heappush(p.heap, (prio, fut))
+            p.grant_next()  # свободный слот — выдаётся сразу
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # слот уже выдали, но нас отменили — возвращаем
+                    p.running -= 1
+                    p.grant_next()
+                raise
+            wait = time.monotonic() - started
+            p.waited += 1
+            p.wait_total += wait
+            p.wait_max = max(p.wait_max, wait)
+            if wait >= 5:
+                logging.info(f"[SCHED] {pool} {label} waited {wait:.1f}s (queue {len(p.heap)})")
+            try:
+                yield
+            finally:
+                p.running -= 1
+                p.grant_next()
+        finally:
+            left = p.per_user.get(uid, 1) - 1
+            if left:
+                p.per_user[uid] = left
+            else:
+                p.per_user.pop(uid, None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for name, p in self._pools.items():
+            queued = sum(1 for _, f in p.heap if not f.done())
+            out[name] = {
+                "slots": p.slots, "running": p.running, "queued": queued,
+                "wait_avg": p.wait_total / p.waited if p.waited else 0.0, "wait_max": p.wait_max,
+            }
+        return out
+
+
+scheduler = Scheduler({NET: SCHED_NET_SLOTS, CPU: SCHED_CPU_SLOTS, UPLOAD: SCHED_UPLOAD_SLOTS})
@@ -0,0 +1,56 @@
+# services/singleflight.py
+# Single-flight: первая заявка на ключ запускает работу, остальные ждут тот же future
+# и получают тот же результат. Запись удаляется, как только работа завершилась.
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, NamedTuple, Optional
+
+
+class MediaResult(NamedTuple):
+    kind: str                        # 'video' | 'audio' | 'animation' | 'document'
+    file_id: str
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration: Optional[int] = None
+
+    @classmethod
+    def from_row(cls, row) -> "MediaResult":
+        return cls(row["kind"], row["file_id"], row["width"], row["height"], row["duration"])
+
+
+class SingleFlight:
+    def __init__(self):
+        self._jobs: Dict[Hashable, asyncio.Future] = {}
+
+    def running(self, key: Hashable) -> bool:
+        return key in self._jobs
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    async def run(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Результат factory() для key; если работа уже идёт — ждём её, а не запускаем вторую."""
+        fut = self._jobs.get(key)
+        if fut is not None:
+            # shield: отмена одного ожидающего не трогает общую работу
+            return await asyncio.shield(fut)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._jobs[key] = fut
+        try:
+            result = await factory()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                fut.set_exception(RuntimeError(f"job {key!r} cancelled"))
+            else:
+                fut.set_exception(e)
+            fut.exception()  # помечаем как прочитанное, даже если ожидающих не было
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._jobs.pop(key, None)
+
+
+# (content_key, variant) -> идущая загрузка+аплоад
+INFLIGHT = SingleFlight()
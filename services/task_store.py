@@ -0,0 +1,145 @@
+# services/task_store.py
+# Реестр инлайн-задач task_id → URL вместо вечного dict DOWNLOAD_TASKS:
+# в памяти — компактные записи с истечением по колесу таймеров и потолком по размеру,
+# на диске — таблица tasks в cache.db (write-behind пачками через поток-писатель cache_db),
+# после рестарта подгружаются свежие.
+import asyncio, logging, time
+from collections import deque
+from typing import Deque, Dict, Optional
+from config import DB_PATH, TASK_TTL, TASK_MEM_MAX, TASK_FLUSH_INTERVAL
+from services.cache_db import db_fetchall, db_fetchone, db_transaction
+
+# ширина слота колеса: все задачи живут одинаково, так что хватает грубой сетки
+_TICK = 3600
+
+
+class TaskRecord:
+    __slots__ = ("url", "expires_at")
+
+    def __init__(self, url: str, expires_at: float):
+        self.url = url
+        self.expires_at = expires_at
+
+
+_tasks: Dict[str, TaskRecord] = {}
+_wheel: Dict[int, Deque[str]] = {}    # слот (expires_at // _TICK) -> task_id в порядке добавления
+_min_tick = int(time.time() // _TICK)
+_pending: Dict[str, TaskRecord] = {}  # ещё не записанные в SQLite
+
+_flusher: Optional[asyncio.Task] = None
+_last_purge = 0.0
+
+
+def _remember(task_id: str, rec: TaskRecord):
+    _tasks[task_id] = rec
+    _wheel.setdefault(int(rec.expires_at // _TICK), deque()).append(task_id)
+    # потолок памяти: выталкиваем самые старые (они остаются в SQLite)
+    while len(_tasks) > TASK_MEM_MAX and _wheel:
+        tick = min(_wheel)
+        bucket = _wheel[tick]
+        while bucket and len(_tasks) > TASK_MEM_MAX:
+            _forget(bucket.popleft(), tick)
+        if not bucket:
+            del _wheel[tick]
+
+
+def _forget(task_id: str, tick: int):
+    rec = _tasks.get(task_id)
+    if rec is not None and int(rec.expires_at // _TICK) == tick:
+        del _tasks[task_id]
+
+
+def _drop_bucket(tick: int):
+    for task_id in _wheel.pop(tick, ()):
+        _forget(task_id, tick)
+
+
+def _advance(now: float):
+    """Проворачивает колесо: всё, чьи слоты целиком в прошлом, уходит из памяти."""
+    global _min_tick
+    cur = int(now // _TICK)
+    while _min_tick < cur:
+        _drop_bucket(_min_tick)
+        _min_tick += 1
+
+
+def put_task(task_id: str, url: str):
+    now = time.time()
+    _advance(now)
+    rec = TaskRecord(url, now + TASK_TTL)
+    _remember(task_id, rec)
+    _pending[task_id] = rec
+
+
+async def get_task(task_id: str) -> Optional[str]:
+    now = time.time()
+    _advance(now)
+    rec = _tasks.get(task_id) or _pending.get(task_id)
+    if rec is None:
+        # вытеснена из памяти или пост старше рестарта — смотрим в SQLite (пул читателей cache_db)
+        row = await db_fetchone("SELECT url, expires_at FROM tasks WHERE task_id=?", (task_id,))
+        if not row:
+            return None
+        rec = TaskRecord(row["url"], row["expires_at"])
+        if rec.expires_at >= now:
+            _remember(task_id, rec)
+    return rec.url if rec.expires_at >= now else None
+
+
+async def flush():
+    global _pending, _last_purge
+    if not _pending:
+        return
+    batch, _pending = _pending, {}
+    now = time.time()
+    stmts = [("INSERT OR REPLACE INTO tasks(task_id, url, expires_at) VALUES (?, ?, ?)", (k, r.url, r.expires_at))
+             for k, r in batch.items()]
+    purge = now - _last_purge > _TICK
+    if purge:
+        stmts.append(("DELETE FROM tasks WHERE expires_at < ?", (now,)))
+    try:
+        await db_transaction(stmts)
+        if purge:
+            _last_purge = now
+    except Exception as e:
+        logging.error(f"[TASKS] flush failed ({len(batch)} tasks): {e}")
+        # вернём в очередь, новые записи приоритетнее
+        _pending = {**batch, **_pending}
+        # но не бесконечно: при долгом отказе диска старейшие теряют только живучесть после рестарта
+        extra = len(_pending) - TASK_MEM_MAX
+        if extra > 0:
+            for task_id in list(_pending)[:extra]:
+                del _pending[task_id]
+            logging.warning(f"[TASKS] pending capped at {TASK_MEM_MAX}, dropped {extra} oldest")
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(TASK_FLUSH_INTERVAL)
+        await flush()
+
+
+async def start():
+    """Подгружает свежие задачи после рестарта и запускает фоновую запись (после db_init)."""
+    global _flusher
+    rows = await db_fetchall(
+        "SELECT task_id, url, expires_at FROM tasks WHERE expires_at >= ? ORDER BY expires_at DESC LIMIT ?",
+        (time.time(), TASK_MEM_MAX),
+    )
+    for task_id, url, expires_at in reversed(rows):
+        _remember(task_id, TaskRecord(url, expires_at))
+    logging.info(f"[TASKS] restored {len(rows)} tasks from {DB_PATH}")
+    if _flusher is None:
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop():
+    global _flusher
+    if _flusher is not None:
+        _flusher.cancel()
+        _flusher = None
+    await flush()
+
+
+def task_stats() -> Dict[str, int]:
+    return {"in_memory": len(_tasks), "pending": len(_pending), "wheel_slots": len(_wheel)}
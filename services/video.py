@@ -1,87 +1,252 @@
-import os, subprocess, logging
+# services/video.py
+# ffmpeg/ffprobe — через async run_proc: отмена задачи убивает процесс и освобождает CPU-слот,
+# а не ждёт таймаута в потоке.
+import os, logging
 from pathlib import Path
 from typing import Optional
-from config import MAX_TG_SIZE, GIF_FMT
+from config import MAX_TG_SIZE, FFMPEG_TIMEOUT, FFPROBE_TIMEOUT
+from utils.proc import run_proc
 from utils.text import format_bytes
 
-def get_video_info(video_path: str):
+async def get_video_info(video_path: str):
     try:
         cmd = [
             "ffprobe", "-v", "error", "-select_streams", "v:0",
             "-show_entries", "stream=width,height,duration",
             "-of", "default=noprint_wrappers=1:nokey=1", video_path,
         ]
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        lines = result.stdout.strip().split("\n")
+        stdout, _ = await run_proc(cmd, timeout=FFPROBE_TIMEOUT)
+        lines = stdout.strip().split("\n")
         width, height, duration = int(lines[0]), int(lines[1]), float(lines[2])
         return int(duration), width, height
     except Exception as e:
         logging.warning(f"⚠ Не удалось получить параметры видео: {e}")
         return 0, 640, 360
 
-def generate_thumbnail(video_path: str) -> Optional[str]:
+async def generate_thumbnail(video_path: str) -> Optional[str]:
     out_path = Path(video_path).with_suffix(".thumb.jpg")
     for ss in ["00:00:02", "00:00:00.5", "00:00:00"]:
         try:
-            subprocess.run([
+            await run_proc([
                 "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
                 "-ss", ss, "-i", video_path, "-frames:v", "1",
                 "-vf", "scale=min(320\\,iw):min(320\\,ih):force_original_aspect_ratio=decrease",
                 "-q:v", "5", str(out_path),
-            ], check=True, capture_output=True)
+            ], timeout=FFPROBE_TIMEOUT)
             if os.path.exists(out_path):
                 if os.path.getsize(out_path) > 200 * 1024:
-                    subprocess.run([
+                    await run_proc([
                         "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
                         "-i", str(out_path),
                         "-vf", "scale=min(320\\,iw):min(320\\,ih):force_original_aspect_ratio=decrease",
                         "-q:v", "10", str(out_path),
-                    ], check=True, capture_output=True)
+                    ], timeout=FFPROBE_TIMEOUT)
                 return str(out_path)
         except Exception:
             continue
     logging.warning("[THUMBNAIL] Не удалось создать превью")
     return None
 
-def video_to_tg_animation(in_path: str, target_mb: int = 50) -> str:
-    base, _ = os.path.splitext(in_path)
-    out = base + ".anim.mp4"
-    attempts = [(480, 30, 23), (360, 30, 24), (320, 24, 26)]
-    for w, fps, crf in attempts:
-        subprocess.run([
-            "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", in_path, "-an",
-            "-vf", f"scale=min({w}\\,iw):-2:flags=lanczos,fps={fps}",
-            "-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "baseline",
-            "-movflags", "+faststart", "-crf", str(crf), out,
-        ], check=True)
-        if os.path.getsize(out) <= target_mb * 1024 * 1024:
+async def probe_audio_codec(path: str) -> Optional[str]:
+    """Кодек первой аудиодорожки или None, если звука нет."""
+    stdout, _ = await run_proc([
+        "ffprobe", "-v", "error", "-select_streams", "a:0",
+        "-show_entries", "stream=codec_name", "-of", "default=noprint_wrappers=1:nokey=1", path,
+    ], timeout=FFPROBE_TIMEOUT)
+    return stdout.strip() or None
+
+# кодек дорожки, который можно положить в контейнер без перекодирования
+_AUDIO_COPY = {"mp3": "mp3", "m4a": "aac"}
+
+async def extract_audio(in_path: str, fmt: str = "mp3", out_dir: Optional[str] = None) -> str:
+    """Аудио из локального видео: stream copy, если кодек подходит, иначе перекодирование."""
+    codec = await probe_audio_codec(in_path)
+    if not codec:
+        raise RuntimeError(f"в {in_path} нет аудиодорожки")
+    base = os.path.splitext(os.path.basename(in_path))[0]
+    out = os.path.join(out_dir or os.path.dirname(in_path), f"{base}.{fmt}")
+    if codec == _AUDIO_COPY.get(fmt):
+        codec_args = ["-c:a", "copy"]
+    elif fmt == "mp3":
+        codec_args = ["-c:a", "libmp3lame", "-q:a", "0"]
+    else:
+        codec_args = ["-c:a", "aac", "-b:a", "192k"]
+    extra = ["-movflags", "+faststart"] if fmt == "m4a" else []
+    await run_proc([
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-i", in_path,
+        "-map", "0:a:0", "-vn", *codec_args, *extra, out,
+    ], timeout=FFMPEG_TIMEOUT)
+    logging.info(f"[AUDIO] {in_path} → {out} ({'copy' if codec_args[1] == 'copy' else codec + '→' + fmt})")
+    return out
+
+# ступени (ширина, fps) от лучшей к худшей; берём первую, на которую хватает бюджета бит
+_ANIM_STEPS = [(480, 30), (360, 30), (320, 24), (240, 15)]
+_ANIM_MIN_BPP = 0.05   # бит на пиксель·кадр: ниже baseline H.264 рассыпается в кашу
+_ANIM_MAX_BPP = 0.20   # выше — на глаз уже не лучше, только толще файл
+_ANIM_HEADROOM = 0.92  # запас на контейнер и неточность ABR
+_ANIM_SAMPLE = 4       # секунд пробы сложности из середины ролика
+_ANIM_SAMPLE_CRF = 23  # «достаточное» качество пробы — столько битрейта ролику реально нужно
+_ANIM_RETRIES = 2
+
+def _out_base(in_path: str, out_dir: Optional[str]) -> str:
+    # производные файлы — в out_dir: рядом с исходником из local_store их принял бы за исходник
+    return os.path.join(out_dir or os.path.dirname(in_path), os.path.splitext(os.path.basename(in_path))[0])
+
+async def probe_duration(path: str) -> float:
+    """Длительность контейнера в секундах (у webm/mkv её часто нет у видеопотока)."""
+    try:
+        stdout, _ = await run_proc([
+            "ffprobe", "-v", "error", "-show_entries", "format=duration",
+            "-of", "default=noprint_wrappers=1:nokey=1", path,
+        ], timeout=FFPROBE_TIMEOUT)
+        return float(stdout.strip())
+    except Exception as e:
+        logging.warning(f"[ANIM] duration probe failed for {path}: {e}")
+        return 0.0
+
+def plan_animation(duration: float, width: int, height: int, target_bytes: int,
+                   need_kbps: Optional[float] = None):
+    """
+    (ширина, fps, kbps) под бюджет target_bytes — считаем сразу, без пробных перекодирований.
+    need_kbps — сколько ролику нужно по пробе сложности; больше этого не даём, даже если бюджет позволяет.
+    """
+    duration = max(float(duration or 0), 1.0)
+    aspect = (height / width) if width and height else 9 / 16
+    budget_kbps = target_bytes * 8 * _ANIM_HEADROOM / duration / 1000
+    for w, fps in _ANIM_STEPS:
+        w = min(w, width or w)
+        pix = w * (w * aspect) * fps
+        if budget_kbps >= pix * _ANIM_MIN_BPP / 1000:
+            ceiling = pix * _ANIM_MAX_BPP / 1000
+            if need_kbps:
+                ceiling = min(ceiling, max(need_kbps, pix * _ANIM_MIN_BPP / 1000))
+            return w, fps, int(min(budget_kbps, ceiling))
+    w, fps = _ANIM_STEPS[-1]
+    return min(w, width or w), fps, int(budget_kbps)
+
+def _anim_cmd(in_path: str, out: str, w: int, fps: int, rate: list, head: list = ()) -> list:
+    return [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *head, "-i", in_path, "-an",
+        "-vf", f"scale=min({w}\\,iw):-2:flags=lanczos,fps={fps}",
+        "-c:v", "libx264", "-pix_fmt", "yuv420p", "-profile:v", "baseline",
+        "-movflags", "+faststart", *rate, out,
+    ]
+
+async def probe_anim_complexity(in_path: str, duration: float, w: int, fps: int,
+                          out_dir: Optional[str] = None) -> Optional[float]:
+    """
+    Пробный CRF-кусок из середины на целевом размере → kbps, которых ролику хватает.
+    Короткие ролики не пробуем: проба стоила бы столько же, сколько само кодирование.
+    """
+    if duration < _ANIM_SAMPLE * 3:
+        return None
+    sample = _out_base(in_path, out_dir) + ".probe.mp4"
+    try:
+        await run_proc(_anim_cmd(
+            in_path, sample, w, fps, ["-crf", str(_ANIM_SAMPLE_CRF), "-preset", "veryfast"],
+            head=["-ss", f"{duration / 2 - _ANIM_SAMPLE / 2:.2f}", "-t", str(_ANIM_SAMPLE)],
+        ), timeout=FFMPEG_TIMEOUT)
+        return os.path.getsize(sample) * 8 / _ANIM_SAMPLE / 1000
+    except Exception as e:
+        logging.warning(f"[ANIM] complexity probe failed for {in_path}: {e}")
+        return None
+    finally:
+        if os.path.exists(sample):
+            os.remove(sample)
+
+async def video_to_tg_animation(in_path: str, target_mb: int = 50, out_dir: Optional[str] = None) -> str:
+    """
+    Тихое H.264-видео для send_animation ≤ target_mb за один проход:
+    длительность и сложность меряем заранее, битрейт держим VBV (maxrate/bufsize),
+    перекодируем, только если перелёт съел весь запас _ANIM_HEADROOM и файл вышел за лимит.
+    """
+    out = _out_base(in_path, out_dir) + ".anim.mp4"
+    target = target_mb * 1024 * 1024
+    duration, src_w, src_h = await get_video_info(in_path)
+    duration = await probe_duration(in_path) or duration
+    w, fps, kbps = plan_animation(duration, src_w, src_h, target)
+    need = await probe_anim_complexity(in_path, duration, w, fps, out_dir)
+    if need:
+        w, fps, kbps = plan_animation(duration, src_w, src_h, target, need)
+    logging.info(f"[ANIM] {in_path}: {duration:.1f}s {src_w}x{src_h} need={need and int(need)}kbps "
+                 f"→ {w}px {fps}fps {kbps}kbps")
+
+    for attempt in range(_ANIM_RETRIES + 1):
+        await run_proc(_anim_cmd(
+            in_path, out, w, fps,
+            ["-b:v", f"{kbps}k", "-maxrate", f"{kbps}k", "-bufsize", f"{kbps * 2}k"],
+        ), timeout=FFMPEG_TIMEOUT)
+        size = os.path.getsize(out)
+        if size <= target or attempt == _ANIM_RETRIES:
             break
+        # перелёт: битрейт пропорционально вниз с запасом, разрешение не трогаем
+        kbps = max(int(kbps * target / size * _ANIM_HEADROOM), 50)
+        logging.info(f"[ANIM] {format_bytes(size)} > {target_mb}MB, retry at {kbps}kbps")
     return out
 
-def video_to_gif(in_path: str) -> str:
-    base = os.path.splitext(in_path)[0]
-    palette = base + "_palette.png"
+# ступени (ширина, fps) для настоящего .gif, от лучшей к худшей
+_GIF_STEPS = [(480, 12), (360, 10), (320, 8), (320, 6), (240, 6)]
+_GIF_SAMPLE = 3        # секунд пробы из середины для оценки размера
+_GIF_HEADROOM = 0.85   # GIF сжимается неровно — оценке доверяем с запасом
+
+def _gif_cmd(in_path: str, out: str, w: int, fps: int, head: list = ()) -> list:
+    # палитра и вывод в одном графе: один декод вместо двух (palettegen, потом paletteuse)
+    graph = (f"[0:v]fps={fps},scale=min({w}\\,iw):-1:flags=lanczos,split[a][b];"
+             f"[a]palettegen=stats_mode=diff[p];[b][p]paletteuse=dither=sierra2_4a")
+    return ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error", *head, "-i", in_path, "-an",
+            "-filter_complex", graph, "-loop", "0", out]
+
+def _gif_rate(w: int, h: int, fps: int) -> float:
+    return w * h * fps  # пикселей в секунду; размер GIF растёт с ним почти линейно
+
+async def video_to_gif(in_path: str, target_bytes: int = MAX_TG_SIZE, out_dir: Optional[str] = None) -> str:
+    """
+    Настоящий .gif ≤ target_bytes. Ширину/fps выбираем по пробному куску из середины,
+    полный файл кодируем один раз; следующая ступень — только если оценка промахнулась.
+    """
+    base = _out_base(in_path, out_dir)
     out = base + ".gif"
+    duration, src_w, src_h = await get_video_info(in_path)
+    duration = max(await probe_duration(in_path) or duration, 1.0)
+    aspect = (src_h / src_w) if src_w and src_h else 9 / 16
 
-    def make_gif(scale_w: int, fps: int):
-        vf = f"fps={fps},scale={scale_w}:-1:flags=lanczos"
-        subprocess.run(["ffmpeg", "-y", "-i", in_path, "-vf", f"{vf},palettegen", palette], check=True, capture_output=True)
-        subprocess.run(["ffmpeg", "-y", "-i", in_path, "-i", palette, "-filter_complex", f"{vf}[x];[x][1:v]paletteuse=dither=sierra2_4a", "-loop", "0", out], check=True, capture_output=True)
-        if os.path.exists(palette):
-            os.remove(palette)
+    def dims(step):
+        w, fps = step
+        w = min(w, src_w or w)
+        return w, fps, _gif_rate(w, w * aspect, fps)
 
-    for w, fps in [(480, 12), (360, 10), (320, 8)]:
-        make_gif(w, fps)
+    # байт на пиксель: по пробе на верхней ступени (короткие ролики не пробуем — дешевле сразу)
+    bpp = None
+    if duration >= _GIF_SAMPLE * 3:
+        sample = base + ".probe.gif"
+        w, fps, rate = dims(_GIF_STEPS[0])
+        try:
+            await run_proc(_gif_cmd(in_path, sample, w, fps, head=[
+                "-ss", f"{duration / 2 - _GIF_SAMPLE / 2:.2f}", "-t", str(_GIF_SAMPLE),
+            ]), timeout=FFMPEG_TIMEOUT)
+            bpp = os.path.getsize(sample) / (_GIF_SAMPLE * rate)
+        except Exception as e:
+            logging.warning(f"[GIF] sample failed for {in_path}: {e}")
+        finally:
+            if os.path.exists(sample):
+                os.remove(sample)
+
+    def pick(start: int) -> int:
+        if bpp is None:
+            return start
+        for k in range(start, len(_GIF_STEPS)):
+            if bpp * dims(_GIF_STEPS[k])[2] * duration <= target_bytes * _GIF_HEADROOM:
+                return k
+        return len(_GIF_STEPS) - 1
+
+    k = pick(0)
+    while True:
+        w, fps, rate = dims(_GIF_STEPS[k])
+        await run_proc(_gif_cmd(in_path, out, w, fps), timeout=FFMPEG_TIMEOUT)
         sz = os.path.getsize(out)
-        logging.info(f"[GIF] {out} = {format_bytes(sz)} (лимит {format_bytes(MAX_TG_SIZE)})")
-        if sz <= MAX_TG_SIZE:
+        logging.info(f"[GIF] {out} {w}px {fps}fps = {format_bytes(sz)} (лимит {format_bytes(target_bytes)})")
+        if sz <= target_bytes or k == len(_GIF_STEPS) - 1:
             return out
-        else:
-            try: os.remove(out)
-            except Exception: pass
-    make_gif(320, 6)
-    return out
-
-def download_gif_from_url(url: str, download_animation_source, gif_fmt: str = GIF_FMT) -> str:
-    mp4_path = download_animation_source(url, gif_fmt)
-    return video_to_gif(mp4_path)
\ No newline at end of file
+        # оценка промахнулась — пересчитываем по фактическому размеру
+        bpp = sz / (duration * rate)
+        k = max(pick(k + 1), k + 1)
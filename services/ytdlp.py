@@ -1,8 +1,35 @@
-import os, json, subprocess, logging
-from typing import Dict, Any
-from config import SAVE_DIR, DEFAULT_UA, COOKIES_FILE, COOKIES_FROM_BROWSER, SMART_FMT_1080
+import asyncio, os, json, subprocess, logging, tempfile
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, NamedTuple, Optional
+from config import (SAVE_DIR, DEFAULT_UA, COOKIES_FILE, COOKIES_FROM_BROWSER, SMART_FMT_1080,
+                    YTDLP_BACKEND, YTDLP_CACHE_DIR, YTDLP_DL_TIMEOUT, YTDLP_STALL_TIMEOUT, YTDLP_INFO_TIMEOUT)
+from services import ytdlp_pool
+from utils.proc import stream_proc
 from utils.text import origin
 
+OUT_TMPL = os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s")
+
+# команда yt-dlp без URL: скачивание всегда отдельным процессом (прогресс, дедлайны, kill при отмене);
+# пул ytdlp_pool обслуживает только -J
+Job = List[str]
+
+class DlProgress(NamedTuple):
+    downloaded: int = 0
+    total: Optional[int] = None
+    speed: Optional[float] = None      # байт/с
+    eta: Optional[int] = None          # секунды
+    filepath: Optional[str] = None     # только в последнем событии — итоговый файл
+
+    @property
+    def percent(self) -> Optional[float]:
+        return self.downloaded * 100.0 / self.total if self.total else None
+
+_PROGRESS_PREFIX = "[dl] "
+_PROGRESS_ARGS = [
+    "--newline", "--progress", "--progress-template",
+    "download:" + _PROGRESS_PREFIX + "%(progress.downloaded_bytes)s|%(progress.total_bytes)s"
+    "|%(progress.total_bytes_estimate)s|%(progress.speed)s|%(progress.eta)s",
+]
+
 def _pick_single_path(stdout: str) -> str:
     lines = [ln.strip() for ln in stdout.splitlines() if ln.strip()]
     if not lines:
@@ -11,64 +38,154 @@ def _pick_single_path(stdout: str) -> str:
         logging.warning("[YTDLP] multiple outputs detected. Using the last one")
     return lines[-1]
 
+def _use_pool() -> bool:
+    return YTDLP_BACKEND == "pool"
+
+def _cookie_args() -> List[str]:
+    if COOKIES_FILE:
+        return ["--cookies", COOKIES_FILE]
+    if COOKIES_FROM_BROWSER:
+        return ["--cookies-from-browser", COOKIES_FROM_BROWSER]
+    return []
+
+def _err_text(e: Exception) -> str:
+    err = getattr(e, "stderr", None)
+    return err if isinstance(err, str) else (err.decode() if err else str(e))
+
+def _usable_info(info: Optional[Dict[str, Any]]) -> bool:
+    return info is not None and info.get("_type", "video") == "video"
+
+def _write_info(info: Dict[str, Any]) -> str:
+    fd, info_path = tempfile.mkstemp(suffix=".info.json", dir=SAVE_DIR)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False)
+    return info_path
+
+def _source_args(url: str, info_path: Optional[str]) -> List[str]:
+    return ["--cache-dir", YTDLP_CACHE_DIR] + (["--load-info-json", info_path] if info_path else [url])
+
+async def _on_stale_info(url: str, e: Exception):
+    # чаще всего протухли подписанные URL форматов → экстрагируем заново
+    logging.warning(f"[YTDLP] download from cached info failed, re-extracting:\n{_err_text(e)[-500:]}")
+    from services.meta_cache import invalidate  # импорт внутри: meta_cache сам импортирует ytdlp
+    # DELETE + commit в meta.db — не в event loop
+    await asyncio.to_thread(invalidate, url)
+
 def ytdlp_info(url: str) -> Dict[str, Any]:
-    r = subprocess.run(["yt-dlp", "-J", url], capture_output=True, text=True, check=True)
+    """-J страницы: через пул (YTDLP_BACKEND=pool) или fork yt-dlp."""
+    if _use_pool():
+        try:
+            return ytdlp_pool.extract_info(url)
+        except ytdlp_pool.PoolUnavailable as e:
+            logging.warning(f"[YTDLP] pool unavailable, fallback to subprocess: {e}")
+    r = subprocess.run(["yt-dlp", "-J", "--cache-dir", YTDLP_CACHE_DIR, url], capture_output=True, text=True, check=True,
+                       timeout=YTDLP_INFO_TIMEOUT)
     return json.loads(r.stdout)
 
-def download_video_with_format(url: str, fmt_id: str) -> str:
-    cmd = [
+# ── задачи (команды yt-dlp без URL) ───────────────────────
+def _format_job(fmt_id: str) -> Job:
+    return [
         "yt-dlp", "-f", fmt_id,
         "--merge-output-format", "mp4",
         "--no-simulate", "--restrict-filenames",
         "--print", "after_move:filepath",
-        "-o", os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s"), url,
+        "-o", OUT_TMPL,
     ]
-    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    return result.stdout.strip()
 
-def download_video_smart(url: str, fmt: str = SMART_FMT_1080) -> str:
-    base_cmd = [
+def _smart_job(fmt: str) -> Job:
+    return [
         "yt-dlp", "-f", fmt,
         "--merge-output-format", "mp4",
         "--no-playlist", "--no-simulate",
         "--print", "after_move:filepath",
-        "-o", os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s"), url,
+        "-o", OUT_TMPL,
     ]
-    try:
-        r = subprocess.run(base_cmd, capture_output=True, text=True, check=True)
-        return _pick_single_path(r.stdout)
-    except subprocess.CalledProcessError as e:
-        err = e.stderr if isinstance(e.stderr, str) else (e.stderr.decode() if e.stderr else str(e))
-        logging.error(f"[SMART] primary yt-dlp failed:\n{err}")
-        cmd = [
-            "yt-dlp", "-f", "best", "--no-playlist", "--max-downloads", "1", "--no-simulate",
-            "--add-header", f"Referer: {origin(url)}", "--user-agent", DEFAULT_UA,
-            "--print", "after_move:filepath",
-            "-o", os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s"), url,
-        ]
-        if COOKIES_FILE:
-            cmd += ["--cookies", COOKIES_FILE]
-        elif COOKIES_FROM_BROWSER:
-            cmd += ["--cookies-from-browser", COOKIES_FROM_BROWSER]
-        r2 = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        return _pick_single_path(r2.stdout)
-
-def download_audio(url: str, fmt: str = "mp3") -> str:
+
+def _smart_fallback_job(url: str) -> Job:
+    return [
+        "yt-dlp", "-f", "best", "--no-playlist", "--max-downloads", "1", "--no-simulate",
+        "--add-header", f"Referer: {origin(url)}", "--user-agent", DEFAULT_UA,
+        "--print", "after_move:filepath",
+        "-o", OUT_TMPL,
+    ] + _cookie_args()
+
+def _audio_job(fmt: str) -> Job:
     base = [
         "yt-dlp", "-x", "--audio-format", fmt, "--audio-quality", "0",
         "--no-playlist", "--no-simulate", "--restrict-filenames",
         "--print", "after_move:filepath",
-        "-o", os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s"), url,
+        "-o", OUT_TMPL,
     ]
-    cmd = (["yt-dlp", "-f", "bestaudio[ext=m4a]/bestaudio"] + base[1:]) if fmt == "m4a" else base
-    r = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    return r.stdout.strip()
+    return (["yt-dlp", "-f", "bestaudio[ext=m4a]/bestaudio"] + base[1:]) if fmt == "m4a" else base
 
-def download_animation_source(url: str, gif_fmt: str) -> str:
-    cmd = [
-        "yt-dlp", "-f", gif_fmt, "--no-playlist", "--no-simulate",
-        "--print", "after_move:filepath",
-        "-o", os.path.join(SAVE_DIR, "%(title)s [%(id)s].%(ext)s"), url,
-    ]
-    r = subprocess.run(cmd, capture_output=True, text=True, check=True)
-    return r.stdout.strip()
\ No newline at end of file
+# ── async API: отдельный процесс yt-dlp, прогресс, дедлайны, отмена ──
+def _parse_progress(line: str) -> Optional[DlProgress]:
+    if not line.startswith(_PROGRESS_PREFIX):
+        return None
+    def num(x: str) -> Optional[float]:
+        try:
+            return float(x)
+        except ValueError:
+            return None  # "NA"
+    parts = line[len(_PROGRESS_PREFIX):].split("|")
+    if len(parts) != 5:
+        return None
+    done, total, estimate, speed, eta = (num(p) for p in parts)
+    total = total or estimate
+    return DlProgress(int(done or 0), int(total) if total else None, speed, int(eta) if eta is not None else None)
+
+async def stream_download(url: str, job: Job, info: Optional[Dict[str, Any]] = None) -> AsyncIterator[DlProgress]:
+    """
+    Запускает yt-dlp и отдаёт DlProgress по мере скачивания; последнее событие — с filepath.
+    Дедлайны: YTDLP_DL_TIMEOUT на всё, YTDLP_STALL_TIMEOUT без вывода (TimeoutExpired).
+    """
+    info_path = _write_info(info) if info is not None else None
+    paths: List[str] = []
+    try:
+        async for name, line in stream_proc(job + _PROGRESS_ARGS + _source_args(url, info_path),
+                                            timeout=YTDLP_DL_TIMEOUT, idle_timeout=YTDLP_STALL_TIMEOUT):
+            p = _parse_progress(line)
+            if p is not None:
+                yield p
+            elif name == "out" and line.strip():
+                paths.append(line)
+    finally:
+        if info_path:
+            try: os.remove(info_path)
+            except OSError: pass
+    yield DlProgress(filepath=_pick_single_path("\n".join(paths)))
+
+ProgressCb = Optional[Callable[[DlProgress], Awaitable[None]]]
+
+async def _adownload_once(url: str, job: Job, info: Optional[Dict[str, Any]], on_progress: ProgressCb) -> str:
+    path = None
+    async for p in stream_download(url, job, info):
+        if p.filepath:
+            path = p.filepath
+        elif on_progress:
+            await on_progress(p)
+    return path
+
+async def _arun_download(url: str, job: Job, info: Optional[Dict[str, Any]], on_progress: ProgressCb) -> str:
+    if _usable_info(info):
+        try:
+            return await _adownload_once(url, job, info, on_progress)
+        except subprocess.CalledProcessError as e:
+            await _on_stale_info(url, e)
+    return await _adownload_once(url, job, None, on_progress)
+
+async def download_video_with_format_async(url: str, fmt_id: str, info: Optional[Dict[str, Any]] = None,
+                                           on_progress: ProgressCb = None) -> str:
+    return await _arun_download(url, _format_job(fmt_id), info, on_progress)
+
+async def download_video_smart_async(url: str, fmt: str = SMART_FMT_1080, info: Optional[Dict[str, Any]] = None,
+                                     on_progress: ProgressCb = None) -> str:
+    try:
+        return await _arun_download(url, _smart_job(fmt), info, on_progress)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"[SMART] primary yt-dlp failed:\n{_err_text(e)}")
+        return await _arun_download(url, _smart_fallback_job(url), None, on_progress)
+
+async def download_audio_async(url: str, fmt: str = "mp3", info: Optional[Dict[str, Any]] = None,
+                               on_progress: ProgressCb = None) -> str:
+    return await _arun_download(url, _audio_job(fmt), info, on_progress)
@@ -0,0 +1,118 @@
+# services/ytdlp_pool.py
+# Пул долгоживущих процессов с yt-dlp Python API для -J (extract_info): без fork `yt-dlp`
+# на каждый вызов, экстракторы импортированы один раз, кэш плеера/подписей YouTube общий (--cache-dir).
+# Скачивания сюда не ходят: они идут отдельным процессом (services/ytdlp, async API) —
+# ради построчного прогресса, дедлайнов и kill группы процессов при отмене.
+import os, logging, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, Optional
+from config import YTDLP_WORKERS, YTDLP_CACHE_DIR, YTDLP_INFO_TIMEOUT
+
+
+class PoolUnavailable(RuntimeError):
+    """Пул не поднялся/упал — вызывающий откатывается на subprocess."""
+
+
+class ExtractError(RuntimeError):
+    """yt-dlp внутри воркера завершился ошибкой (аналог CalledProcessError)."""
+
+
+class ExtractTimeout(ExtractError):
+    """Воркер не уложился в YTDLP_INFO_TIMEOUT; пул пересоздан."""
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+# ── код ниже выполняется в процессах пула ────────────────
+_ydl_info = None
+
+
+def _base_opts() -> Dict[str, Any]:
+    return {
+        "quiet": True,
+        "no_warnings": True,
+        "noprogress": True,
+        "cachedir": YTDLP_CACHE_DIR,
+    }
+
+
+def _worker_init():
+    global _ydl_info
+    import yt_dlp
+    # один YoutubeDL на процесс для -J: экстракторы и плеер YouTube прогреваются один раз
+    _ydl_info = yt_dlp.YoutubeDL(_base_opts())
+
+
+def _w_info(url: str) -> Dict[str, Any]:
+    try:
+        info = _ydl_info.extract_info(url, download=False)
+        return _ydl_info.sanitize_info(info)
+    except Exception as e:
+        # исключения yt-dlp не всегда переживают pickle — отдаём текстом
+        raise ExtractError(str(e)) from None
+
+
+# ── сторона бота ──────────────────────────────────────────
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is not None:
+        return _pool
+    with _pool_lock:
+        if _pool is None:
+            try:
+                import yt_dlp  # noqa: F401  проверяем, что модуль вообще есть
+            except ImportError as e:
+                raise PoolUnavailable(f"yt_dlp module not installed: {e}")
+            os.makedirs(YTDLP_CACHE_DIR, exist_ok=True)
+            # forkserver: воркеры форкаются от чистого процесса, а не от бота с event-loop и потоками
+            ctx = multiprocessing.get_context("forkserver")
+            ctx.set_forkserver_preload(["yt_dlp"])
+            _pool = ProcessPoolExecutor(max_workers=YTDLP_WORKERS, mp_context=ctx, initializer=_worker_init)
+            logging.info(f"[YTDLP/POOL] started {YTDLP_WORKERS} workers, cache-dir {YTDLP_CACHE_DIR}")
+    return _pool
+
+
+def _recycle(pool: ProcessPoolExecutor):
+    """Выбрасывает пул с зависшим воркером: shutdown сам его не остановит — добиваем процессы."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # _processes — приватное, но другого способа достать pid воркеров у ProcessPoolExecutor нет
+    for proc in list((getattr(pool, "_processes", None) or {}).values()):
+        try:
+            proc.terminate()
+        except Exception:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _call(fn, *args):
+    global _pool
+    pool = _get_pool()
+    try:
+        return pool.submit(fn, *args).result(timeout=YTDLP_INFO_TIMEOUT)
+    except FutureTimeout:
+        logging.error(f"[YTDLP/POOL] {fn.__name__}{args} exceeded {YTDLP_INFO_TIMEOUT}s, recycling pool")
+        _recycle(pool)
+        raise ExtractTimeout(f"yt-dlp worker timed out after {YTDLP_INFO_TIMEOUT}s") from None
+    except BrokenProcessPool as e:
+        # воркер умер (OOM/segfault) — пул пересоздастся при следующем вызове
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        raise PoolUnavailable(f"worker pool broken: {e}")
+
+
+def extract_info(url: str) -> Dict[str, Any]:
+    return _call(_w_info, url)
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -1,5 +1,5 @@
 # state.py
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict
 from pyrogram import Client as PyroClient
 import asyncio
 from config import PYRO_API_ID, PYRO_API_HASH, PYRO_SESSION
@@ -35,16 +35,6 @@ async def set_bot_identity(username: Optional[str], bot_id: Optional[int]) -> No
     BOT_USERNAME = username
     BOT_ID = bot_id
 
-INFLIGHT: Dict[Tuple[str, str], asyncio.Lock] = {}
-
-def get_inflight_lock(content_key: str, variant: str) -> asyncio.Lock:
-    k = (content_key, variant)
-    lk = INFLIGHT.get(k)
-    if not lk:
-        lk = asyncio.Lock()
-        INFLIGHT[k] = lk
-    return lk
-
 async def close_pyro_app() -> None:
     global pyro_app
     if pyro_app and pyro_app.is_connected:
@@ -52,5 +42,4 @@ async def close_pyro_app() -> None:
         pyro_app = None
 
 # runtime словари
-DOWNLOAD_TASKS: Dict[str, str] = {}
 AWAITING_FILES: Dict[str, object] = {}
@@ -0,0 +1,101 @@
+# utils/callback_data.py
+# Компактная подписанная callback_data: действие + task_id + канонический ключ
+# контента + формат в ≤64 байтах base64. С ключом в самой кнопке попадание в кэш
+# не требует ни реестра задач, ни повторного резолва ссылки — переживает рестарт
+# и годится для любого процесса бота с тем же секретом.
+#
+# Раскладка (до base64url без '='):
+#   [ver<<5 | action][task_id 4Б][extractor 1Б][len id 1Б][id][fmt ...][hmac 6Б]
+# Старый формат "action|task|fmt" по-прежнему понимается (кнопки уже разосланных постов).
+import base64, hashlib, hmac
+from typing import NamedTuple, Optional
+from config import CALLBACK_SECRET, TOKEN
+
+_VERSION = 1
+_MAC_LEN = 6
+_MAX_LEN = 64  # лимит Telegram на callback_data
+
+_ACTIONS = ("noop", "auto", "vauto", "aauto", "more", "fmt", "aud", "audfmt", "gif", "giffile")
+_ACTION_IDX = {a: i for i, a in enumerate(_ACTIONS)}
+
+# частые экстракторы — одним байтом; 0xFF — ключ целиком строкой, 0 — ключа нет
+_EXTRACTORS = ("", "youtube", "tiktok", "twitter", "instagram", "vimeo", "coub")
+_EXTRACTOR_IDX = {e: i for i, e in enumerate(_EXTRACTORS)}
+_RAW_KEY = 0xFF
+
+_SECRET = (CALLBACK_SECRET or hashlib.sha256(f"callback:{TOKEN}".encode()).hexdigest()).encode()
+
+
+class CallbackData(NamedTuple):
+    action: str
+    task_id: str
+    content_key: Optional[str] = None
+    fmt: Optional[str] = None
+
+
+def _mac(payload: bytes) -> bytes:
+    return hmac.new(_SECRET, payload, hashlib.sha256).digest()[:_MAC_LEN]
+
+
+def _legacy(action: str, task_id: str, fmt: Optional[str]) -> str:
+    return "|".join([action, task_id] + ([fmt] if fmt else []))
+
+
+def encode_callback(action: str, task_id: str, content_key: Optional[str] = None,
+                    fmt: Optional[str] = None) -> str:
+    """callback_data для кнопки; без ключа или если не влезает — старый текстовый формат."""
+    if not content_key or action not in _ACTION_IDX:
+        return _legacy(action, task_id, fmt)
+    try:
+        task_raw = bytes.fromhex(task_id)
+    except ValueError:
+        return _legacy(action, task_id, fmt)
+    if len(task_raw) != 4:
+        return _legacy(action, task_id, fmt)
+
+    extractor, _, vid = content_key.partition(":")
+    code = _EXTRACTOR_IDX.get(extractor.lower()) if vid else None
+    if not code:
+        code, vid = _RAW_KEY, content_key
+    vid_raw = vid.encode()
+    if len(vid_raw) > 255:
+        return _legacy(action, task_id, fmt)
+
+    payload = (bytes([_VERSION << 5 | _ACTION_IDX[action]]) + task_raw
+               + bytes([code, len(vid_raw)]) + vid_raw + (fmt or "").encode())
+    out = base64.urlsafe_b64encode(payload + _mac(payload)).rstrip(b"=").decode()
+    return out if len(out) <= _MAX_LEN else _legacy(action, task_id, fmt)
+
+
+def decode_callback(data: str) -> Optional[CallbackData]:
+    """CallbackData или None, если данные битые/подпись не сошлась."""
+    if not data:
+        return None
+    if "|" in data:
+        parts = data.split("|", 2)
+        return CallbackData(parts[0], parts[1], None, parts[2] if len(parts) > 2 else None)
+    try:
+        raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    except (ValueError, TypeError):
+        return None
+    if len(raw) < 7 + _MAC_LEN:
+        return None
+    payload, mac = raw[:-_MAC_LEN], raw[-_MAC_LEN:]
+    if not hmac.compare_digest(mac, _mac(payload)):
+        return None
+    head, task_raw, code, n = payload[0], payload[1:5], payload[5], payload[6]
+    action_idx = head & 0x1F
+    if head >> 5 != _VERSION or action_idx >= len(_ACTIONS) or len(payload) < 7 + n:
+        return None
+    try:
+        vid = payload[7:7 + n].decode()
+        fmt = payload[7 + n:].decode() or None
+    except UnicodeDecodeError:
+        return None
+    if code == _RAW_KEY:
+        content_key = vid
+    elif 0 < code < len(_EXTRACTORS):
+        content_key = f"{_EXTRACTORS[code]}:{vid}"
+    else:
+        content_key = None
+    return CallbackData(_ACTIONS[action_idx], task_raw.hex(), content_key, fmt)
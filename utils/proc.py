@@ -0,0 +1,90 @@
+# utils/proc.py
+# Асинхронный запуск внешних процессов (yt-dlp/ffmpeg/ffprobe) без to_thread:
+# построчный вывод, дедлайны (общий и «тишина в выводе»), kill всей группы процессов при отмене.
+import asyncio, os, signal, subprocess
+from collections import deque
+from typing import AsyncIterator, List, Optional, Tuple
+
+# -J у yt-dlp — одна строка на мегабайты
+_LINE_LIMIT = 32 * 1024 * 1024
+
+
+async def _kill_group(proc: asyncio.subprocess.Process):
+    if proc.returncode is not None:
+        return
+    # yt-dlp запускает ffmpeg дочерним процессом — гасим всю сессию
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+    try:
+        await asyncio.wait_for(proc.wait(), 3)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+async def stream_proc(cmd: List[str], *, timeout: Optional[float] = None,
+                      idle_timeout: Optional[float] = None) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Запускает cmd и отдаёт строки вывода как ("out" | "err", line).
+    timeout — на весь процесс, idle_timeout — максимум без новых строк.
+    По истечении: subprocess.TimeoutExpired, rc != 0: subprocess.CalledProcessError.
+    Отмена/выход из цикла убивает группу процессов.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+        start_new_session=True, limit=_LINE_LIMIT,
+    )
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump(name: str, stream: asyncio.StreamReader):
+        try:
+            async for raw in stream:
+                await queue.put((name, raw.decode("utf-8", "replace").rstrip("\r\n")))
+        finally:
+            await queue.put((name, None))
+
+    readers = [asyncio.create_task(pump("out", proc.stdout)), asyncio.create_task(pump("err", proc.stderr))]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout if timeout else None
+    err_tail: deque = deque(maxlen=50)
+    open_streams = 2
+    try:
+        while open_streams:
+            wait = idle_timeout
+            if deadline is not None:
+                left = max(deadline - loop.time(), 0)
+                wait = left if wait is None else min(wait, left)
+            try:
+                name, line = await asyncio.wait_for(queue.get(), wait)
+            except asyncio.TimeoutError:
+                hit_deadline = deadline is not None and loop.time() >= deadline
+                raise subprocess.TimeoutExpired(cmd, timeout if hit_deadline else idle_timeout,
+                                                stderr="\n".join(err_tail)) from None
+            if line is None:
+                open_streams -= 1
+                continue
+            if name == "err":
+                err_tail.append(line)
+            yield name, line
+        rc = await proc.wait()
+        if rc != 0:
+            raise subprocess.CalledProcessError(rc, cmd, stderr="\n".join(err_tail))
+    finally:
+        for t in readers:
+            t.cancel()
+        await _kill_group(proc)
+
+
+async def run_proc(cmd: List[str], *, timeout: Optional[float] = None,
+                   idle_timeout: Optional[float] = None) -> Tuple[str, str]:
+    """Как subprocess.run(check=True, capture_output=True), но async: -> (stdout, stderr)."""
+    out: List[str] = []
+    err: List[str] = []
+    async for name, line in stream_proc(cmd, timeout=timeout, idle_timeout=idle_timeout):
+        (out if name == "out" else err).append(line)
+    return "\n".join(out), "\n".join(err)
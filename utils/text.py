@@ -7,7 +7,7 @@ def format_bytes(n: int) -> str:
     for unit in ("B", "KB", "MB", "GB"):
         if x < 1024 or unit == "GB":
             return f"{x:.0f} {unit}" if unit == "B" else f"{x:.2f} {unit}"
-    x /= 1024
+        x /= 1024
 
 
 _YT_ID = re.compile(r'(?:v=|/shorts/|youtu\.be/)([A-Za-z0-9_-]{11})')
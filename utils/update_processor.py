@@ -0,0 +1,89 @@
+# utils/update_processor.py
+# Параллельная обработка апдейтов PTB: общий лимит + строгий порядок внутри одного
+# сообщения (два нажатия на один инлайн-пост не гоняются друг с другом).
+import asyncio, logging
+from typing import Any, Awaitable, Dict, Hashable, List, Optional
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# ожидание дольше — пишем в лог
+SLOW_DISPATCH_SEC = 2.0
+
+
+def ordering_key(update: object) -> Optional[Hashable]:
+    """Ключ последовательной обработки; None — можно параллельно с кем угодно."""
+    if not isinstance(update, Update):
+        return None
+    cq = update.callback_query
+    if cq:
+        if cq.inline_message_id:
+            return ("inline", cq.inline_message_id)
+        if cq.message:
+            return ("msg", cq.message.chat_id, cq.message.message_id)
+        return None
+    if update.inline_query:
+        return None  # новые запросы и так вытесняют старые
+    msg = update.effective_message
+    if msg:
+        # по сообщению, а не по чату: пачка ссылок одного юзера качается минутами
+        # и не должна держать остальных в группе (и его же следующие сообщения)
+        return ("msg", msg.chat_id, msg.message_id)
+    return None
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent: int):
+        # лимит держим сами (после лока ключа), чтобы апдейт, ждущий свою очередь,
+        # не занимал слот; базовому классу — заведомо больше
+        super().__init__(max_concurrent_updates=max_concurrent * 64)
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._locks: Dict[Hashable, List[Any]] = {}  # key -> [lock, число ожидающих]
+        self.stats = {"updates": 0, "wait_total": 0.0, "wait_max": 0.0, "in_flight": 0}
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        key = ordering_key(update)
+        entry = None
+        if key is not None:
+            entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+        try:
+            if entry:
+                await entry[0].acquire()
+            try:
+                async with self._slots:
+                    self._record_wait(loop.time() - started, key)
+                    self.stats["in_flight"] += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self.stats["in_flight"] -= 1
+            finally:
+                if entry:
+                    entry[0].release()
+        finally:
+            if entry:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._locks.pop(key, None)
+
+    def _record_wait(self, wait: float, key: Optional[Hashable]):
+        st = self.stats
+        st["updates"] += 1
+        st["wait_total"] += wait
+        st["wait_max"] = max(st["wait_max"], wait)
+        if wait >= SLOW_DISPATCH_SEC:
+            logging.warning(f"[UPD] dispatch wait {wait:.1f}s key={key} in_flight={st['in_flight']}")
+
+    def dispatch_stats(self) -> Dict[str, Any]:
+        st = self.stats
+        avg = st["wait_total"] / st["updates"] if st["updates"] else 0.0
+        return dict(st, wait_avg=avg, keys_locked=len(self._locks))
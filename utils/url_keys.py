@@ -0,0 +1,135 @@
+# utils/url_keys.py
+# Офлайн URL → "extractor:id" без сети: реестр парсеров по хосту.
+# Ключи совпадают с тем, что даёт yt-dlp (extractor_key.lower() + ":" + id),
+# поэтому попадают в те же строки cache.db.
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from utils.youtube import extract_youtube_id
+from utils.text import normalize_youtube_url
+
+# query-параметры, которые не влияют на контент
+_TRACKING_PARAMS = {
+    "fbclid", "gclid", "yclid", "dclid", "msclkid", "mc_cid", "mc_eid",
+    "igshid", "igsh", "si", "feature", "ref", "ref_src", "ref_url", "share_id",
+    "is_from_webapp", "sender_device", "sender_web_id", "_r", "_t",
+}
+
+Parser = Callable[[str, str, str], Optional[str]]  # (host, path, query) -> id
+_PARSERS: List[Tuple[Tuple[str, ...], str, Parser]] = []
+_LINKS: Dict[str, str] = {}  # extractor -> шаблон канонической ссылки по {id}
+
+
+def register(hosts: Tuple[str, ...], extractor: str, link: Optional[str] = None):
+    """Декоратор: парсер id для указанных хостов (и их поддоменов)."""
+    def deco(fn: Parser) -> Parser:
+        _PARSERS.append((hosts, extractor, fn))
+        if link:
+            _LINKS[extractor] = link
+        return fn
+    return deco
+
+
+def _host_matches(host: str, hosts: Tuple[str, ...]) -> bool:
+    return any(host == h or host.endswith("." + h) for h in hosts)
+
+
+def strip_tracking(url: str) -> str:
+    """Убирает utm_* и прочие трекинг-параметры и #fragment."""
+    u = urlparse(url.strip())
+    if not u.scheme or not u.netloc:
+        return url.strip()
+    q = [(k, v) for k, v in parse_qsl(u.query, keep_blank_values=True)
+         if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS]
+    return urlunparse((u.scheme, u.netloc, u.path, u.params, urlencode(q), ""))
+
+
+def normalize_url(url: str) -> str:
+    """Одна форма ссылки для кэшей: без трекинга, YouTube — в виде watch?v=<id>."""
+    return normalize_youtube_url(strip_tracking(url))
+
+
+def offline_content_key(url: str) -> Optional[str]:
+    """canonical "extractor:id" по одной ссылке или None, если сайт неизвестен."""
+    u = urlparse(strip_tracking(url))
+    host = (u.hostname or "").lower()
+    for hosts, extractor, fn in _PARSERS:
+        if _host_matches(host, hosts):
+            vid = fn(host, u.path, u.query)
+            if vid:
+                return f"{extractor}:{vid}"
+    return None
+
+
+def canon_key(key: str) -> str:
+    # "YouTube:abc" -> "youtube:abc": экстрактор всегда в нижнем регистре
+    if not key or ":" not in key:
+        return key
+    extractor, rest = key.split(":", 1)
+    return f"{(extractor or 'unknown').lower()}:{rest}"
+
+
+def url_for_key(content_key: Optional[str]) -> Optional[str]:
+    """Обратно: "extractor:id" → ссылка, по которой yt-dlp найдёт то же видео."""
+    if not content_key or ":" not in content_key:
+        return None
+    extractor, vid = content_key.split(":", 1)
+    link = _LINKS.get(extractor.lower())
+    return link.format(id=vid) if link and vid else None
+
+
+# ── парсеры ───────────────────────────────────────────────
+@register(("youtube.com", "youtu.be", "youtube-nocookie.com"), "youtube",
+          link="https://www.youtube.com/watch?v={id}")
+def _youtube(host: str, path: str, query: str) -> Optional[str]:
+    if path.startswith("/live/"):
+        cand = path.split("/")[2]
+        return cand if len(cand) == 11 else None
+    return extract_youtube_id(f"https://{host}{path}?{query}")
+
+
+_TIKTOK_VIDEO = re.compile(r"^/@[^/]+/(?:video|photo)/(\d+)")
+
+
+@register(("tiktok.com",), "tiktok", link="https://www.tiktok.com/@_/video/{id}")
+def _tiktok(host: str, path: str, query: str) -> Optional[str]:
+    # vm.tiktok.com/<code> — короткая ссылка, без редиректа id не узнать
+    m = _TIKTOK_VIDEO.match(path)
+    return m.group(1) if m else None
+
+
+_TWITTER_STATUS = re.compile(r"^/(?:[^/]+|i/web|i)/status(?:es)?/(\d+)")
+
+
+@register(("twitter.com", "x.com", "fxtwitter.com", "vxtwitter.com", "fixupx.com"), "twitter",
+          link="https://x.com/i/status/{id}")
+def _twitter(host: str, path: str, query: str) -> Optional[str]:
+    m = _TWITTER_STATUS.match(path)
+    return m.group(1) if m else None
+
+
+_INSTAGRAM_POST = re.compile(r"^/(?:[^/]+/)?(?:p|reel|reels|tv)/([A-Za-z0-9_-]+)")
+
+
+@register(("instagram.com",), "instagram", link="https://www.instagram.com/p/{id}/")
+def _instagram(host: str, path: str, query: str) -> Optional[str]:
+    m = _INSTAGRAM_POST.match(path)
+    return m.group(1) if m else None
+
+
+_VIMEO_ID = re.compile(r"^/(?:video/)?(\d+)(?:/|$)")
+
+
+@register(("vimeo.com",), "vimeo", link="https://vimeo.com/{id}")
+def _vimeo(host: str, path: str, query: str) -> Optional[str]:
+    m = _VIMEO_ID.match(path)
+    return m.group(1) if m else None
+
+
+_COUB_VIEW = re.compile(r"^/(?:view|embed)/([A-Za-z0-9]+)")
+
+
+@register(("coub.com",), "coub", link="https://coub.com/view/{id}")
+def _coub(host: str, path: str, query: str) -> Optional[str]:
+    m = _COUB_VIEW.match(path)
+    return m.group(1) if m else None